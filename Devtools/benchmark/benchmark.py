@@ -0,0 +1,348 @@
+"""
+Benchmark of the PredIG pipeline orchestration with stand-in tools.
+
+The executables in fake_tools/ follow the command line and output formats of
+NetCleave, NOAH, the PCH R script, mhcflurry-predict and tapmat_pred_fsa,
+producing deterministic synthetic scores almost instantly. The time spent
+by a stage is then the cost of the pipeline around the tool: writing and
+reading its files, launching it, deduplicating, caching and joining.
+
+Every input size runs in a fresh process, so the peak memory of each size
+is measured on its own. The results are written to a JSON file tagged with
+the git commit, and can be compared with the file of another commit:
+
+    python Devtools/benchmark/benchmark.py --sizes 100,1000,10000
+    python Devtools/benchmark/benchmark.py --compare main.json --output head.json
+
+Requires pandas, numpy and xgboost, none of the real tools.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_TOOLS = os.path.join(HERE, "fake_tools")
+REPOSITORY = os.path.dirname(os.path.dirname(HERE))
+INCLUDE = os.path.join(REPOSITORY, "Immunoinformatics", "Include")
+
+ALLELES = [
+    "HLA-A*02:01",
+    "HLA-A*01:01",
+    "HLA-B*07:02",
+    "HLA-B*08:01",
+    "HLA-C*07:01",
+    "HLA-C*07:02",
+]
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def gitCommit() -> dict:
+    """
+    Commit of the benchmarked tree and whether it has local changes
+    """
+
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], cwd=REPOSITORY, capture_output=True, text=True
+        ).stdout.strip()
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": git("status", "--porcelain", "--untracked-files=no") != "",
+    }
+
+
+def writeInput(folder: str, mode: str, size: int, seed: int) -> str:
+    """
+    Write a synthetic input: size epitope/allele rows (csv mode, RECOMBINANT
+    simulation) or size protein records of 300 residues (fasta mode)
+    """
+
+    rng = random.Random(seed)
+
+    if mode == "fasta":
+        path = os.path.join(folder, "input.fasta")
+        with open(path, "w") as f:
+            for i in range(size):
+                sequence = "".join(rng.choice(AMINO_ACIDS) for _ in range(300))
+                f.write(f">sp|P{i:05d}|PROT{i}\n{sequence}\n")
+        return path
+
+    # Repeat epitopes and proteins like real submissions do
+    epitopes = [
+        "".join(rng.choice(AMINO_ACIDS) for _ in range(rng.randint(8, 11)))
+        for _ in range(max(1, size // 3))
+    ]
+    proteins = [
+        "".join(rng.choice(AMINO_ACIDS) for _ in range(300))
+        for _ in range(max(1, min(size // 50, 2000)))
+    ]
+
+    path = os.path.join(folder, "input.csv")
+    with open(path, "w") as f:
+        f.write("epitope,HLA_allele,protein_seq,protein_name\n")
+        for i in range(size):
+            protein = rng.randrange(len(proteins))
+            f.write(
+                f"{rng.choice(epitopes)},{rng.choice(ALLELES)},"
+                f"{proteins[protein]},PROT{protein}\n"
+            )
+    return path
+
+
+def writeModel(folder: str, seed: int) -> str:
+    """
+    Train a small deterministic XGBoost model on the 13 PredIG features
+    """
+
+    import numpy as np
+    import xgboost as xgb
+
+    rng = np.random.default_rng(seed)
+    features = rng.random((512, 13), dtype=np.float32)
+    labels = (features[:, 0] + features[:, 1] > 1).astype(int)
+
+    booster = xgb.train(
+        {"objective": "binary:logistic", "max_depth": 3, "seed": seed},
+        xgb.DMatrix(features, label=labels),
+        num_boost_round=20,
+    )
+    path = os.path.join(folder, "predig_model.json")
+    booster.save_model(path)
+    return path
+
+
+def benchmarkParams(folder: str, mode: str, seed: int, args) -> dict:
+    """
+    Pipeline parameters pointing every tool to its stand-in
+    """
+
+    pch_script = os.path.join(folder, "predig_pch_calc.R")
+    noah_model = os.path.join(folder, "noah_model.pkl")
+    matrix = os.path.join(folder, "tap.logodds.mat")
+    for path in (pch_script, noah_model, matrix):
+        open(path, "w").close()
+
+    return {
+        "simulation": 1 if mode == "fasta" else 3,
+        "alleles": "\n".join(ALLELES),
+        "seed": seed,
+        "model": noah_model,
+        "modelXG": writeModel(folder, seed),
+        "modelsXG": {},
+        "mat": matrix,
+        "alpha": None,
+        "precursor_len": None,
+        "peptide_len": None,
+        "pch_path": pch_script,
+        "mhcflurry_path": os.path.join(FAKE_TOOLS, "mhcflurry-predict"),
+        "mhcflurry_engine": "mhcflurry-predict",
+        "netcleave_path": os.path.join(FAKE_TOOLS, "NetCleave.py"),
+        "noah_path": os.path.join(FAKE_TOOLS, "main_NOAH.py"),
+        "tapmap_path": os.path.join(FAKE_TOOLS, "tapmat_pred_fsa"),
+        "python_exec": sys.executable,
+        "stage_workers": args.stage_workers,
+        "tapmap_workers": 7,
+        "netcleave_workers": 4,
+        "xgboost_threads": 0,
+        "score_cache": False,
+        "score_cache_path": os.path.join(folder, "scores.sqlite"),
+        "score_cache_max_entries": 5000000,
+        "columns_to_delete": [],
+        "threshold": None,
+        "scratch_dir": "",
+        "tool_io": args.tool_io,
+        "checkpoint_dir": "",
+        "pair_chunk_size": args.pair_chunk_size,
+        "prefilter": args.prefilter,
+        "prefilter_max_percentile": 2.0,
+        "prefilter_min_presentation": 0.5,
+    }
+
+
+def runSize(size: int, args) -> dict:
+    """
+    Run the pipeline once for an input size, in the current process
+    """
+
+    sys.path.insert(0, INCLUDE)
+    os.environ["PATH"] = FAKE_TOOLS + os.pathsep + os.environ["PATH"]
+
+    from metrics import RunMetrics
+    from pipeline import readInput, writePredIG
+
+    folder = tempfile.mkdtemp(prefix="predig_benchmark_")
+    os.chdir(folder)
+
+    input_file = writeInput(folder, args.mode, size, args.seed)
+    params = benchmarkParams(folder, args.mode, args.seed, args)
+    df, fasta = readInput(params["simulation"], input_file)
+
+    metrics = RunMetrics()
+    start = time.perf_counter()
+    rows_out = writePredIG(params, "output.csv", df=df, fasta=fasta, metrics=metrics)
+    wall_time = time.perf_counter() - start
+
+    os.chdir(HERE)
+    shutil.rmtree(folder)
+
+    stages = metrics.toDict()
+    for stage in stages.values():
+        # Time not spent inside the tools
+        child_time = stage["child_user_time"] + stage["child_system_time"]
+        stage["overhead"] = round(max(0.0, stage["wall_time"] - child_time), 4)
+
+    return {
+        "size": size,
+        "rows_out": rows_out,
+        "wall_time": round(wall_time, 4),
+        "throughput_rows_per_s": round(rows_out / wall_time, 1),
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+        "stages": stages,
+    }
+
+
+def compare(previous: dict, current: dict):
+    """
+    Print the wall time of every stage and size against a previous result
+    """
+
+    previous_sizes = {result["size"]: result for result in previous["results"]}
+    print(f"Comparing {current['commit'][:10]} against {previous['commit'][:10]}")
+    print(
+        f"{'Size':>9}  {'Stage':<10}  {'Before (s)':>10}  "
+        f"{'After (s)':>10}  {'Ratio':>6}"
+    )
+    for result in current["results"]:
+        before = previous_sizes.get(result["size"])
+        if before is None:
+            continue
+
+        stages = [("Total", before["wall_time"], result["wall_time"])]
+        for name, stage in result["stages"].items():
+            if name in before["stages"]:
+                stages.append(
+                    (name, before["stages"][name]["wall_time"], stage["wall_time"])
+                )
+
+        for name, old, new in stages:
+            ratio = new / old if old > 0 else float("nan")
+            print(
+                f"{result['size']:>9}  {name:<10}  {old:>10.3f}  "
+                f"{new:>10.3f}  {ratio:>6.2f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes",
+        default="100,1000,10000,100000,1000000",
+        help="Comma separated input sizes (rows in csv mode, proteins in fasta mode)",
+    )
+    parser.add_argument("--mode", choices=["csv", "fasta"], default="csv")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--stage-workers", type=int, default=5)
+    parser.add_argument("--tool-io", choices=["files", "pipes"], default="files")
+    parser.add_argument("--pair-chunk-size", type=int, default=250000)
+    parser.add_argument(
+        "--prefilter",
+        choices=["off", "affinity percentile", "presentation score"],
+        default="off",
+    )
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="Result file of a previous benchmark")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        # Child process: run one size and print its result
+        result = runSize(args.single, args)
+        print("BENCHMARK_RESULT " + json.dumps(result))
+        return
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        print(f"Benchmarking {size} ({args.mode})", flush=True)
+        proc = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--single",
+                str(size),
+                "--mode",
+                args.mode,
+                "--seed",
+                str(args.seed),
+                "--stage-workers",
+                str(args.stage_workers),
+                "--tool-io",
+                args.tool_io,
+                "--pair-chunk-size",
+                str(args.pair_chunk_size),
+                "--prefilter",
+                args.prefilter,
+            ],
+            capture_output=True,
+            text=True,
+        )
+        lines = [
+            line
+            for line in proc.stdout.splitlines()
+            if line.startswith("BENCHMARK_RESULT ")
+        ]
+        if proc.returncode != 0 or not lines:
+            print(proc.stdout[-4000:])
+            print(proc.stderr[-4000:])
+            raise SystemExit(f"The benchmark of size {size} failed")
+
+        result = json.loads(lines[-1][len("BENCHMARK_RESULT ") :])
+        results.append(result)
+        print(
+            f"  {result['rows_out']} rows in {result['wall_time']:.2f} s "
+            f"({result['throughput_rows_per_s']:.0f} rows/s), "
+            f"peak RSS {result['peak_rss_mb']:.0f} MB"
+        )
+        for name, stage in result["stages"].items():
+            print(
+                f"    {name:<10} {stage['wall_time']:>9.3f} s "
+                f"overhead {stage['overhead']:>9.3f} s "
+                f"rows {stage['rows_in']} -> {stage['rows_out']}"
+            )
+
+    report = {
+        **gitCommit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "mode": args.mode,
+        "stage_workers": args.stage_workers,
+        "tool_io": args.tool_io,
+        "pair_chunk_size": args.pair_chunk_size,
+        "prefilter": args.prefilter,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Stand-in for NetCleave.py with the same command line and output files.
+
+    NetCleave.py --predict <input> --pred_input <1|2|3>
+
+Mode 1 reads a fasta and scores every 9-mer of every record, modes 2 and 3
+read the epitope CSV and score each row. The predictions are written to
+output/input_NetCleave.csv (mode 1) or output/_NetCleave.csv (modes 2, 3)
+in the current directory. Scores are a deterministic hash of the input.
+"""
+
+import argparse
+import csv
+import os
+import zlib
+
+
+def score(*values: str) -> float:
+    return zlib.crc32("|".join(values).encode()) / 2**32
+
+
+def readFasta(path: str):
+    name, sequence = None, []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, "".join(sequence)
+                name, sequence = line[1:].split()[0], []
+            elif line:
+                sequence.append(line)
+    if name is not None:
+        yield name, "".join(sequence)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--predict", required=True)
+parser.add_argument("--pred_input", type=int, required=True)
+args = parser.parse_args()
+
+os.makedirs("output", exist_ok=True)
+columns = ["epitope", "prediction", "uniprot_id", "warnings"]
+
+if args.pred_input == 1:
+    with open(os.path.join("output", "input_NetCleave.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for name, sequence in readFasta(args.predict):
+            for i in range(len(sequence) - 8):
+                epitope = sequence[i : i + 9]
+                writer.writerow([epitope, f"{score(name, epitope):.6f}", name, ""])
+else:
+    protein_column = "uniprot_id" if args.pred_input == 2 else "protein_seq"
+    with open(args.predict, "r", newline="") as f_in, open(
+        os.path.join("output", "_NetCleave.csv"), "w", newline=""
+    ) as f_out:
+        writer = csv.writer(f_out)
+        writer.writerow(columns)
+        for row in csv.DictReader(f_in):
+            protein = row[protein_column]
+            writer.writerow(
+                [
+                    row["epitope"],
+                    f"{score(protein, row['epitope']):.6f}",
+                    row.get("uniprot_id", row.get("protein_name", "")),
+                    "",
+                ]
+            )
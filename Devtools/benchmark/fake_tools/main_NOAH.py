@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Stand-in for NOAH's main_NOAH.py with the same command line and output.
+
+    main_NOAH.py -i <peptide,HLA csv> -m <model> -o <output>
+
+Writes one "HLA<TAB>peptide<TAB>score" line per input row, without header.
+Scores are a deterministic hash of the pair.
+"""
+
+import argparse
+import csv
+import zlib
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-i", required=True)
+parser.add_argument("-m", required=True)
+parser.add_argument("-o", required=True)
+args = parser.parse_args()
+
+with open(args.i, "r", newline="") as f_in, open(args.o, "w") as f_out:
+    for row in csv.DictReader(f_in):
+        score = zlib.crc32(f"{row['HLA']}|{row['peptide']}".encode()) / 2**32
+        f_out.write(f"{row['HLA']}\t{row['peptide']}\t{score:.6f}\n")
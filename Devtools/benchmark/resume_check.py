@@ -0,0 +1,117 @@
+"""
+Resume check of the PredIG checkpoints with the stand-in tools.
+
+A first FASTA run with one allele fails in NOAH, leaving the checkpoints of
+the stages before it. A second run on the same fasta with another allele
+resumes from the same checkpoint folder. Its results must match a run
+without checkpoints: the NetCleave checkpoint is reused, the MHCflurry
+checkpoints of the first allele are not.
+
+    python Devtools/benchmark/resume_check.py --prefilter "presentation score"
+
+Exits with status 1 when the resumed results differ. Requires pandas, numpy
+and xgboost, none of the real tools.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+from benchmark import FAKE_TOOLS, INCLUDE, benchmarkParams, writeInput
+
+
+def runPipeline(params: dict, fasta: str):
+    from pipeline import predictPredIG
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        results = predictPredIG(params, fasta=fasta)
+    return results, log.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--proteins", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--pair-chunk-size", type=int, default=500)
+    parser.add_argument(
+        "--prefilter",
+        default="off",
+        choices=["off", "affinity percentile", "presentation score"],
+    )
+    args = parser.parse_args()
+    args.stage_workers = 5
+    args.tool_io = "files"
+
+    sys.path.insert(0, INCLUDE)
+    os.environ["PATH"] = FAKE_TOOLS + os.pathsep + os.environ["PATH"]
+
+    folder = tempfile.mkdtemp(prefix="predig_resume_")
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        fasta = writeInput(folder, "fasta", args.proteins, args.seed)
+        params = benchmarkParams(folder, "fasta", args.seed, args)
+
+        # First attempt: another allele, NOAH fails after MHCflurry ran
+        failing = dict(
+            params,
+            alleles="HLA-A*02:01",
+            noah_path=os.path.join(folder, "missing_NOAH.py"),
+            checkpoint_dir=os.path.join(folder, "checkpoints"),
+        )
+        try:
+            runPipeline(failing, fasta)
+        except Exception as e:
+            print(f"First run failed as expected: {str(e).splitlines()[0]}")
+        else:
+            raise SystemExit("The first run was expected to fail in NOAH")
+
+        resumed, log = runPipeline(
+            dict(
+                params,
+                alleles="HLA-B*07:02",
+                checkpoint_dir=failing["checkpoint_dir"],
+            ),
+            fasta,
+        )
+        reference, _ = runPipeline(dict(params, alleles="HLA-B*07:02"), fasta)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder, ignore_errors=True)
+
+    restored = [line for line in log.splitlines() if "restored from" in line]
+    print(f"Resumed run: {len(resumed)} rows, {len(restored)} stages restored")
+    for line in restored:
+        print(f"    {line}")
+
+    failed = False
+    if not any("'NetCleave'" in line for line in restored):
+        print("The NetCleave checkpoint of the first run was not reused")
+        failed = True
+    if any("'MHCflurry'" in line for line in restored):
+        print("A MHCflurry checkpoint of the other allele was restored")
+        failed = True
+
+    missing = int(resumed["mhcflurry_affinity"].isna().sum())
+    if missing:
+        print(f"{missing} rows without MHCflurry affinity")
+        failed = True
+
+    # Compared as written out, restored text columns come back as object
+    if resumed.to_csv(index=False) != reference.to_csv(index=False):
+        print("The resumed results differ from a run without checkpoints")
+        failed = True
+
+    if failed:
+        raise SystemExit(1)
+
+    print("The resumed run matches a run without checkpoints")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Import budget of the plugin registration.
+
+Horus imports Immunoinformatics.py, which registers the blocks, configs and
+pages, every time it loads the plugin. The registration should not import
+pandas, NumPy, XGBoost or any of the tool libraries; those belong in the
+block actions. This check imports the plugin in fresh processes and fails
+when a heavy module was imported, or when the median registration time
+(the HorusAPI import itself excluded) is over the budget:
+
+    python Devtools/import_budget/import_budget.py --budget 0.25
+
+The slowest imports of the last run are listed with -X importtime, to find
+what broke the budget. None of the heavy modules are needed. Without
+HorusAPI the plugin registers against a stand-in module that accepts any
+name, so the check also runs outside Horus (npm run test:imports).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY = os.path.dirname(os.path.dirname(HERE))
+PLUGIN = os.path.join(REPOSITORY, "Immunoinformatics")
+INCLUDE = os.path.join(PLUGIN, "Include")
+
+HEAVY_MODULES = [
+    "pandas",
+    "numpy",
+    "xgboost",
+    "Bio",
+    "flask",
+    "itables",
+    "rpy2",
+    "mhcflurry",
+    "tensorflow",
+]
+
+# Run in the child process: time the plugin registration alone
+REGISTRATION = """
+import json
+import sys
+import time
+
+sys.path[:0] = [{plugin!r}, {include!r}]
+
+try:
+    import HorusAPI
+except ImportError:
+    import types
+
+    # Stand-in accepting every class, attribute and call of the plugin
+    class _Anything(type):
+        def __getattr__(cls, name):
+            return name
+
+    class _Stub(metaclass=_Anything):
+        def __init__(self, *args, **kwargs):
+            self.__dict__.update(kwargs)
+
+        def __getattr__(self, name):
+            return lambda *args, **kwargs: None
+
+    HorusAPI = types.ModuleType("HorusAPI")
+    HorusAPI.__getattr__ = lambda name: type(name, (_Stub,), {{}})
+    sys.modules["HorusAPI"] = HorusAPI
+
+start = time.perf_counter()
+import Immunoinformatics
+elapsed = time.perf_counter() - start
+
+heavy = sorted(
+    name for name in {heavy!r} if any(
+        module == name or module.startswith(name + ".") for module in sys.modules
+    )
+)
+print(json.dumps({{"elapsed": elapsed, "heavy": heavy}}))
+"""
+
+
+def runRegistration(importtime: bool = False) -> dict:
+    code = REGISTRATION.format(plugin=PLUGIN, include=INCLUDE, heavy=HEAVY_MODULES)
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", code]
+
+    # Write no __pycache__, so every run compiles the plugin like a fresh install
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    process = subprocess.run(
+        command, capture_output=True, text=True, cwd=REPOSITORY, env=env
+    )
+    if process.returncode != 0:
+        raise SystemExit(f"The plugin registration failed:\n{process.stderr}")
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["importtime"] = process.stderr
+    return result
+
+
+def slowestImports(importtime: str, count: int) -> list:
+    """
+    (self time in seconds, module) of the slowest imports, HorusAPI excluded
+    """
+
+    imports = []
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, _, module = line[len("import time:") :].split("|")
+        module = module.strip()
+        if module.split(".")[0] == "HorusAPI":
+            continue
+        imports.append((int(self_time) / 1e6, module))
+
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--budget", type=float, default=0.25, help="Seconds for the registration"
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    try:
+        import HorusAPI  # noqa: F401
+    except ImportError:
+        print("HorusAPI is not installed, registering against a stand-in")
+
+    runs = [runRegistration() for _ in range(max(1, args.runs - 1))]
+    runs.append(runRegistration(importtime=True))
+
+    elapsed = statistics.median(run["elapsed"] for run in runs)
+    heavy = sorted({name for run in runs for name in run["heavy"]})
+
+    print(f"Plugin registration: {elapsed:.3f} s (budget {args.budget:.3f} s)")
+    print("Slowest imports (self time):")
+    for self_time, module in slowestImports(runs[-1]["importtime"], args.top):
+        print(f"    {self_time:8.4f} s  {module}")
+
+    failed = False
+    if heavy:
+        print(f"Heavy modules imported by the registration: {', '.join(heavy)}")
+        failed = True
+    if elapsed > args.budget:
+        print("The registration is over the budget")
+        failed = True
+
+    if failed:
+        raise SystemExit(1)
+
+    print("The plugin registration is within the import budget")
+
+
+if __name__ == "__main__":
+    main()
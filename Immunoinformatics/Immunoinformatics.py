@@ -22,6 +22,10 @@ def create_plugin():
 
     immunoPlugin.addBlock(predigBlock)
 
+    from Blocks.PredIGRescore import predigRescoreBlock  # type: ignore
+
+    immunoPlugin.addBlock(predigRescoreBlock)
+
     # from Blocks.NOAH import noahBlock  # type: ignore
 
     # immunoPlugin.addBlock(noahBlock)
@@ -67,6 +71,18 @@ def create_plugin():
 
     immunoPlugin.addConfig(tapmatExecutableConfig)
 
+    from Configs.parallelConfig import parallelConfig
+
+    immunoPlugin.addConfig(parallelConfig)
+
+    from Configs.cacheConfig import scoreCacheConfig
+
+    immunoPlugin.addConfig(scoreCacheConfig)
+
+    from Configs.prefilterConfig import prefilterConfig
+
+    immunoPlugin.addConfig(prefilterConfig)
+
     # ========== Pages ========== #
 
     from Pages.results import results_page
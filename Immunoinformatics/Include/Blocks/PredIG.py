@@ -2,8 +2,6 @@
 Module containing the PredIG block for the Immunoinformatics plugin 
 """
 
-import pandas as pd
-import json
 import random
 
 from typing import Union, cast
@@ -16,13 +14,7 @@ from HorusAPI import (
     VariableTypes,
     InputBlock,
 )
-from utils import (
-    run_Predig_tapmap,
-    runPredigMHCflurry,
-    runPredigNetCleave,
-    runPredigNOAH,
-    runPredigPCH,
-)
+from model_registry import PREDIG_MODELS
 
 
 from Pages.setup_predig import setup_predig_page
@@ -146,8 +138,11 @@ def runPredIG(block: PluginBlock):
     """
 
     import os
+    import shutil
 
-    import xgboost as xgb
+    # pandas, NumPy and the pipeline are only needed once the block runs
+    from metrics import RunMetrics
+    from pipeline import countQueries, readInput, runPredIGBatch, writePredIG
 
     # Get the input file from group
     # if block.selectedInputGroup == input_txt_group.id:
@@ -256,14 +251,20 @@ def runPredIG(block: PluginBlock):
     peptide_len = None
 
     modelXG_name = input_setup.get("modelXG", "PredIG-NeoA")
-    if modelXG_name == "PredIG-NonCan":
-        modelXG = "/home/perry/data/Programs/Immuno/Predig/spw_indep2_rescale_predig_model.model"
-    elif modelXG_name == "PredIG-Path":
-        modelXG = "/home/perry/data/Programs/Immuno/Predig/spw_indep1_rescale_predig_model.model"
-    else:  # "PredIG-NeoA"
-        modelXG = (
-            "/home/perry/data/Programs/Immuno/Predig/spw_xtreme_predig_model.model"
+    modelXG = PREDIG_MODELS.get(modelXG_name, PREDIG_MODELS["PredIG-NeoA"])
+
+    # Optionally score with several models at once, one column per model
+    modelsXG_names = input_setup.get("modelsXG") or []
+    if isinstance(modelsXG_names, str):
+        modelsXG_names = [m.strip() for m in modelsXG_names.split(",") if m.strip()]
+    unknown_models = [m for m in modelsXG_names if m not in PREDIG_MODELS]
+    if unknown_models:
+        raise ValueError(
+            f"Unknown PredIG models: {unknown_models}. Available: {list(PREDIG_MODELS)}"
         )
+    modelsXG = {name: PREDIG_MODELS[name] for name in modelsXG_names}
+    if len(modelsXG) == 1 and modelsXG_names[0] == modelXG_name:
+        modelsXG = {}
 
     mat = input_setup.get(
         "mat", "/home/perry/data/Programs/Immuno/netCTLpan-1.1/data/tap.logodds.mat"
@@ -301,224 +302,105 @@ def runPredIG(block: PluginBlock):
 
     # /home/perry/data/Github/Neoantigens-NOAH/noah/main_NOAH.py
     # Check if the input file is valid
-    if not os.path.isfile(input_file):
-        raise ValueError("The input file is not valid")
-
-    df = None
-    fasta = None
-    if simulation == 1:
-        fasta = input_file.replace('"', "").replace("'", "")
-    else:
-        df = pd.read_csv(input_file)
+    df, fasta = readInput(simulation, input_file)
 
-        # Replace cells that have "" or ''
-        df = df.replace('"', "")
-        df = df.replace("'", "")
-
-        # Verify that each row has the correct number of columns (all are filled)
-        column_lenght = df.shape[1]
-
-        for i, row in df.iterrows():
-            if len(row) != column_lenght:
-                raise ValueError(
-                    "The input CSV file must contain the same number of columns in each row."
-                )
-
-        # if df.shape[0] > 5000:
-        #     raise ValueError("The input CSV file must contain less than 5000 rows.")
+    # if df is not None and df.shape[0] > 5000:
+    #     raise ValueError("The input CSV file must contain less than 5000 rows.")
 
     python_exec = block.config.get("python_exec", "python")
-    print("Running NetCleave")
-    # Run the NetCleave / can be placed before to generate csv when case of Fasta
-    # When fasta set Hallele in input
-    output_netcleave = runPredigNetCleave(
-        df_csv=df,
-        predigNetcleave_path=netCleavePath,
-        mode=simulation,
-        fasta=fasta,
-        python_exec=python_exec,
-    )
-
-    # If we are runnign with a fasta, concatenate the results of netcleave with HLA alleles
-    if simulation == 1:
-        df = output_netcleave
-
-        # Add a new column to the dataframe, the HLA alleles
-        alleles: str = input_setup.get("HLA_alleles", "")
-
-        list_alleles = alleles.split("\n")
-
-        # Initialize an empty list to hold DataFrames
-        df_list = []
-
-        # Loop through the list of values and create a DataFrame for each one
-        for value in list_alleles:
-            df_copy = df.copy()
-            df_copy["HLA_allele"] = value.strip()
-            df_list.append(df_copy)
-
-        df = pd.concat(df_list, ignore_index=True)
-
-        # Remove the index colum (does not have names)
-        df = df.reset_index(drop=True)
-
-        # Save as csv
-        df.to_csv("input_fasta.csv", index=False)
-
-    else:
-        df = cast(pd.DataFrame, df)
-
-    # Run the PCH ["epitope"]
-    print("Running PCH")
-    output_pch = runPredigPCH(
-        df_csv=df,
-        seed=int(seed),
-        predigPCH_path=pchPath,
-    )
-
-    print("Running MHCflurry")
-    # Run the MHCflurry ["epitope", "hla_allele"]
-    output_flurry = runPredigMHCflurry(
-        df_csv=df,
-        predigMHCflurry_path=mhcflurryPath,
-    )
-
-    print("Running NOAH")
-
-    # Run the NOAH, ["HLA", "epitope", "NOAH_score"] id="HLA", "epitope"
-    output_noah = runPredigNOAH(
-        df_csv=df, predigNOAH_path=noahPath, model=model, python_exec=python_exec
-    )
-
-    print("Running tapmat_pred_fsa")
-    output_tapmap = run_Predig_tapmap(
-        df_csv=df,
-        tapmap_path=tapmat_pred_fsa_path,
-        mat=mat,
-        peptide_len=peptide_len,
-        alpha=alpha,
-        precursor_len=precursor_len,
-    )
-
-    print("Joining the outputs")
-
-    # Sequentially merge the DataFrames on a common non-overlapping column, for example 'epitope'
-    # df_joined = output_pch.merge(output_flurry, on="epitope", how="inner")
-    # df_joined = df_joined.merge(output_netcleave, on="epitope", how="inner")
-    # df_joined = df_joined.merge(output_tapmap, on="epitope", how="inner")
-    # df_joined = df_joined.merge(output_noah, on="epitope", how="inner")
+    tapmap_workers = int(block.config.get("tapmap_workers", 7))
+
+    params = {
+        "simulation": simulation,
+        "alleles": alleles,
+        "seed": seed,
+        "model": model,
+        "modelXG": modelXG,
+        "modelsXG": modelsXG,
+        "mat": mat,
+        "alpha": alpha,
+        "precursor_len": precursor_len,
+        "peptide_len": peptide_len,
+        "pch_path": pchPath,
+        "mhcflurry_path": mhcflurryPath,
+        "mhcflurry_engine": block.config.get("MHC_engine", "mhcflurry-predict"),
+        "netcleave_path": netCleavePath,
+        "noah_path": noahPath,
+        "tapmap_path": tapmat_pred_fsa_path,
+        "python_exec": python_exec,
+        "stage_workers": int(block.config.get("stage_workers", 5)),
+        "tapmap_workers": tapmap_workers,
+        "netcleave_workers": int(block.config.get("netcleave_workers", 4)),
+        "xgboost_threads": int(block.config.get("xgboost_threads", 0)),
+        "scratch_dir": block.config.get("scratch_dir", ""),
+        "tool_io": block.config.get("tool_io", "files"),
+        "pair_chunk_size": int(block.config.get("pair_chunk_size", 250000)),
+        "prefilter": block.config.get("prefilter", "off"),
+        "prefilter_max_percentile": float(
+            block.config.get("prefilter_max_percentile", 2.0)
+        ),
+        "prefilter_min_presentation": float(
+            block.config.get("prefilter_min_presentation", 0.5)
+        ),
+        # Shared by the batch shards, their inputs give them different keys
+        "checkpoint_dir": (
+            os.path.abspath(".predig_checkpoints")
+            if block.config.get("checkpoints", True)
+            else ""
+        ),
+        "score_cache": bool(block.config.get("score_cache", True)),
+        "score_cache_path": block.config.get(
+            "score_cache_path", "~/.immuno/predig_scores.sqlite"
+        ),
+        "score_cache_max_entries": int(
+            block.config.get("score_cache_max_entries", 5000000)
+        ),
+        "columns_to_delete": block.config.get("columns_to_delete", []),
+        "threshold": input_setup.get("threshold"),
+    }
 
-    df_joined = output_pch.merge(
-        output_flurry, left_index=True, right_index=True, how="left"
-    )
+    filename = block.flow.name + "_output.csv"
 
-    if simulation == 1:
-        df_joined = df_joined.merge(df, left_index=True, right_index=True, how="left")
+    # The joined features are kept to rescore the run with the PredIG rescore block
+    features_file = block.flow.name + "_features.npz"
+
+    # Wall time, rows and tool resources of every stage
+    metrics = RunMetrics()
+
+    # Big submissions are split into shards that run in parallel
+    shard_size = int(block.config.get("batch_shard_size", 500))
+    queries = countQueries(df=df, fasta=fasta)
+    if queries > shard_size:
+        runPredIGBatch(
+            params,
+            filename,
+            df=df,
+            fasta=fasta,
+            shard_size=shard_size,
+            max_workers=int(block.config.get("batch_workers", 2)),
+            features_file=features_file,
+            metrics=metrics,
+        )
     else:
-        df_joined = df_joined.merge(
-            output_netcleave, left_index=True, right_index=True, how="left"
+        # Save the results as a CSV, written chunk by chunk
+        writePredIG(
+            params,
+            filename,
+            df=df,
+            fasta=fasta,
+            features_file=features_file,
+            metrics=metrics,
         )
 
-    df_joined = df_joined.merge(
-        output_tapmap,
-        left_index=True,
-        right_index=True,
-        how="left",
-        suffixes=("", "_tapmap"),
-    )
-
-    df_joined["id"] = df_joined["hla_allele"] + "_" + df_joined["epitope"]
-    output_noah["id"] = output_noah["hla_allele"] + "_" + output_noah["epitope"]
-    df_joined = df_joined.merge(
-        output_noah, on="id", how="left", suffixes=("", "_noah")
-    )
-
-    print("Launching the XGBoost model")
-    if "hla_allele_y" in df_joined.columns:
-        df_joined = df_joined.drop(columns=["hla_allele_y"])
-    if "hla_allele_x" in df_joined.columns:
-        df_joined = df_joined.rename(columns={"hla_allele_x": "hla_allele"})
-
-    df_xgboost = df_joined[
-        [
-            "netcleave",
-            "NOAH",
-            "mw_peptide",
-            "mw_tcr_contact",
-            "hydroph_peptide",
-            "hydroph_tcr_contact",
-            "charge_peptide",
-            "charge_tcr_contact",
-            "stab_peptide",
-            "mhcflurry_affinity",
-            "mhcflurry_affinity_percentile",
-            "mhcflurry_processing_score",
-            "mhcflurry_presentation_score",
-        ]
-    ]
-
-    # df_xgboost.to_csv("df_xgboost.csv", index=False)
-    predig_model = xgb.Booster()
-    predig_model.load_model(modelXG)
-    predig_input_matrix = xgb.DMatrix(df_xgboost)
-    predig_score = predig_model.predict(predig_input_matrix)
-    df_joined = pd.concat([df_joined, pd.Series(predig_score, name="predig")], axis=1)
-
-    df_joined["id"] = df_joined["hla_allele"] + "_" + df_joined["epitope"]
-
-    # Rename and sort the columns
-    name_mapping = {
-        "Id": "ID",
-        "Epitope": "epitope",
-        "Hla_allele": "HLA_allele",
-        "Predig": "PredIG",
-        "NOAH": "NOAH",
-        "TAP": "TAP",
-        "Netcleave": "NetCleave",
-        "Mhcflurry_affinity": "mhcflurry_affinity",
-        "Mhcflurry_affinity_percentile": "mhcflurry_affinity_percentile",
-        "Mhcflurry_presentation_score": "mhcflurry_presentation_score",
-        "Mhcflurry_processing_score": "mhcflurry_processing_score",
-        "Hydroph_peptide": "Hydrophobicity_peptide",
-        "Mw_peptide": "MW_peptide",
-        "Charge_peptide": "Charge_peptide",
-        "Stab_peptide": "Stab_peptide",
-        "Tcr_contact": "TCR_contact",
-        "Hydroph_tcr_contact": "Hydrophobicity_tcr_contact",
-        "Mw_tcr_contact": "MW_tcr_contact",
-        "Charge_tcr_contact": "Charge_tcr_contact",
-    }
-
-    name_mapping = {key.lower(): value for key, value in name_mapping.items()}
-
-    df_joined = df_joined.rename(str.lower, axis="columns")
-
-    # Sort based on the mapping
-    df_joined = df_joined[name_mapping.keys()]
-
-    # Rename
-    df_joined = df_joined.rename(columns=name_mapping)
-
-    # Remove unwanted columns
-    columns_to_delete: list[str] = block.config.get("columns_to_delete", [])
-
-    columns_to_delete = [c.lower() for c in columns_to_delete]
-
-    for col in df_joined.columns:
-        if col.lower() in columns_to_delete:
-            df_joined = df_joined.drop(columns=col)
-
-    # Remove any *_output.csv file to prevent other programs messing the folder
-    import glob
-
-    for file in glob.glob("*output*.csv"):
-        os.remove(file)
+    print("PredIG simulations finished")
 
-    # Save the results as a CSV
-    filename = block.flow.name + "_output.csv"
-    df_joined.to_csv(filename, index=False)
+    # The run succeeded, nothing left to resume
+    if params["checkpoint_dir"]:
+        shutil.rmtree(params["checkpoint_dir"], ignore_errors=True)
 
-    print("PredIG simulations finished")
+    metrics.write("predig_metrics.json")
+    print("============== Stage metrics ==============")
+    print(metrics.summary())
 
     safe_path = os.path.abspath(filename)
 
@@ -560,12 +442,12 @@ description += (
     "\nPredIG predicts the immunogenicity of full proteins vs. a list of HLA-I alleles."
 )
 description += "\nPredIG score is a probability from 0 to 1, being 1 the max likelihood for pHLA-I immunogenicity."
-description += "\nNote: Max 500 queries per submission."
+description += "\nNote: Submissions over 500 queries are split into shards and run in batch mode."
 
 
 predigBlock = InputBlock(
     name="PredIG",
-    description="An interpretable predictor of CD8+ T-cell epitope immunogenicity.\nPredIG predicts the immunogenicity of given pairs of epitope and HLA-I alleles.\nPredIG predicts the immunogenicity of full proteins vs. a list of HLA-I alleles.\nPredIG score is a probability from 0 to 1, being 1 the max likelihood for pHLA-I immunogenicity.\n\nNote: Max 500 queries per submission.",
+    description="An interpretable predictor of CD8+ T-cell epitope immunogenicity.\nPredIG predicts the immunogenicity of given pairs of epitope and HLA-I alleles.\nPredIG predicts the immunogenicity of full proteins vs. a list of HLA-I alleles.\nPredIG score is a probability from 0 to 1, being 1 the max likelihood for pHLA-I immunogenicity.\n\nNote: Submissions over 500 queries are split into shards and run in batch mode.",
     action=runPredIG,
     variable=setup_predig_variable,
     # variables=[
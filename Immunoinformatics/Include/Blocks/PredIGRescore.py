@@ -0,0 +1,118 @@
+"""
+Module containing the PredIG rescore block for the Immunoinformatics plugin
+"""
+
+from HorusAPI import Extensions, PluginBlock, PluginVariable, VariableTypes
+
+from model_registry import PREDIG_MODELS
+
+# ==========================#
+# Variable inputs
+# ==========================#
+inputFeaturesVar = PluginVariable(
+    name="PredIG features",
+    id="input_features",
+    description="The features file (<flow>_features.npz) saved by a previous PredIG run.",
+    type=VariableTypes.FILE,
+    allowedValues=["npz"],
+)
+
+
+# ==========================#
+# Variable outputs
+# ==========================#
+outputPredIG = PluginVariable(
+    name="Output CSV",
+    id="output_predig",
+    description="The output csv",
+    type=VariableTypes.FILE,
+    allowedValues=["csv"],
+)
+
+
+##############################
+#       Other variables      #
+##############################
+modelXGVar = PluginVariable(
+    name="PredIG model",
+    id="modelXG",
+    description="The PredIG model used to rescore the features.",
+    type=VariableTypes.STRING_LIST,
+    defaultValue="PredIG-NeoA",
+    allowedValues=list(PREDIG_MODELS.keys()),
+)
+thresholdVar = PluginVariable(
+    name="Threshold",
+    id="threshold",
+    description="PredIG score from which a pHLA is flagged as immunogenic. Leave empty to skip the classification.",
+    type=VariableTypes.FLOAT,
+    defaultValue=None,
+)
+
+
+def runPredIGRescore(block: PluginBlock):
+    """
+    Run the PredIG rescore block
+    """
+
+    import os
+
+    from pipeline import rescorePredIG
+
+    featuresFile = block.inputs.get(inputFeaturesVar.id, None)
+
+    if featuresFile is None or not os.path.isfile(featuresFile):
+        raise ValueError("The features file is not valid")
+
+    modelXG_name = block.variables.get(modelXGVar.id, "PredIG-NeoA")
+    threshold = block.variables.get(thresholdVar.id, None)
+
+    params = {
+        "modelXG": PREDIG_MODELS.get(modelXG_name, PREDIG_MODELS["PredIG-NeoA"]),
+        "modelsXG": {},
+        "threshold": threshold,
+        "xgboost_threads": int(block.config.get("xgboost_threads", 0)),
+        "columns_to_delete": block.config.get("columns_to_delete", []),
+    }
+
+    print(f"Rescoring with {modelXG_name}")
+
+    df_joined = rescorePredIG(params, featuresFile)
+
+    filename = block.flow.name + "_rescore_output.csv"
+    df_joined.to_csv(filename, index=False)
+
+    print("PredIG rescore finished")
+
+    safe_path = os.path.abspath(filename)
+
+    from App import AppDelegate  # type: ignore
+
+    if AppDelegate().mode == "webapp":
+
+        # Get only the last 3 components of the path /flo_dir/flow_results/results.csv
+        safe_path = "/".join(safe_path.split("/")[-3:])
+
+    print(f"Results are at: '{safe_path}'")
+
+    Extensions().storeExtensionResults(
+        "immuno",
+        "results",
+        data={"csv": safe_path},
+        title="PredIG rescore results",
+    )
+
+    block.setOutput(outputPredIG.id, filename)
+
+
+# ==========================#
+# Block definition
+# ==========================#
+predigRescoreBlock = PluginBlock(
+    name="PredIG rescore",
+    description="Rescore the features of a previous PredIG run with another model or threshold, without running the tools again.",
+    inputs=[inputFeaturesVar],
+    outputs=[outputPredIG],
+    variables=[modelXGVar, thresholdVar],
+    action=runPredIGRescore,
+)
@@ -2,8 +2,6 @@
 Module containing the NetCleave block for the Immunoinformatics plugin 
 """
 
-from utils import run_Predig_tapmap
-
 from HorusAPI import Extensions, PluginBlock, PluginVariable, VariableGroup, VariableTypes
 
 # ==========================#
@@ -72,6 +70,8 @@ def runTAP(block: PluginBlock):
 
     import pandas as pd
 
+    from utils import run_Predig_tapmap
+
     inputFile = block.inputs.get(inputFileVar.id, None)
     try:
         os.path.exists(inputFile)
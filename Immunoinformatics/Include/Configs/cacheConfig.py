@@ -0,0 +1,45 @@
+from HorusAPI import PluginConfig, PluginVariable, VariableTypes
+
+useCacheVariable = PluginVariable(
+    id="score_cache",
+    name="Use the score cache",
+    description="Reuse the NetCleave, PCH, MHCflurry, NOAH and TAP scores computed in previous runs",
+    type=VariableTypes.BOOLEAN,  # type: ignore
+    defaultValue=True,
+)
+
+cachePathVariable = PluginVariable(
+    id="score_cache_path",
+    name="Score cache path",
+    description="Path to the SQLite database holding the cached scores",
+    type=VariableTypes.STRING,  # type: ignore
+    defaultValue="~/.immuno/predig_scores.sqlite",
+)
+
+cacheSizeVariable = PluginVariable(
+    id="score_cache_max_entries",
+    name="Score cache size",
+    description="Maximum number of cached rows, the least recently used ones are evicted first",
+    type=VariableTypes.INTEGER,  # type: ignore
+    defaultValue=5000000,
+)
+
+checkpointsVariable = PluginVariable(
+    id="checkpoints",
+    name="Stage checkpoints",
+    description="Save the output of every stage in the flow folder, so relaunching a failed run skips the stages that already finished. The checkpoints are removed once the run succeeds",
+    type=VariableTypes.BOOLEAN,  # type: ignore
+    defaultValue=True,
+)
+
+# Create a plugin configuration for the score cache
+scoreCacheConfig = PluginConfig(
+    name="Score cache",
+    description="Configure the persistent cache of the PredIG tool scores and the stage checkpoints",
+    variables=[
+        useCacheVariable,
+        cachePathVariable,
+        cacheSizeVariable,
+        checkpointsVariable,
+    ],
+)
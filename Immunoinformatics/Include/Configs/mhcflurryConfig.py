@@ -8,6 +8,15 @@ mhcflurryPathVariable = PluginVariable(
     defaultValue="mhcflurry-predict",
 )
 
+mhcflurryEngineVariable = PluginVariable(
+    id="MHC_engine",
+    name="MHCflurry engine",
+    description="Run mhcflurry-predict for every submission or keep the MHCflurry models loaded in the Horus process",
+    type=VariableTypes.STRING_LIST,
+    defaultValue="mhcflurry-predict",
+    allowedValues=["mhcflurry-predict", "in-process"],
+)
+
 
 def checkInstallation(block: PluginConfig):
     import os
@@ -15,6 +24,15 @@ def checkInstallation(block: PluginConfig):
 
     print("verifying MHCflurry installation")
 
+    if block.variables.get(mhcflurryEngineVariable.id) == "in-process":
+        try:
+            import mhcflurry
+        except ImportError:
+            raise Exception(
+                "The in-process MHCflurry engine requires the mhcflurry package"
+            )
+        return
+
     predigMHCflurry = block.variables.get(mhcflurryPathVariable.id)
     # Check if the path is valid
     if str(predigMHCflurry).startswith("mhcflurry"):
@@ -35,6 +53,6 @@ def checkInstallation(block: PluginConfig):
 mhcflurryExecutableConfig = PluginConfig(
     name="MHCflurry executable",
     description="Configure the path to the MHCflurry executables",
-    variables=[mhcflurryPathVariable],
+    variables=[mhcflurryPathVariable, mhcflurryEngineVariable],
     action=checkInstallation,
 )
@@ -0,0 +1,91 @@
+from HorusAPI import PluginConfig, PluginVariable, VariableTypes
+
+stageWorkersVariable = PluginVariable(
+    id="stage_workers",
+    name="Concurrent stages",
+    description="Maximum number of PredIG stages (NetCleave, PCH, MHCflurry, NOAH, TAP) running at the same time",
+    type=VariableTypes.INTEGER,  # type: ignore
+    defaultValue=5,
+)
+
+tapmapWorkersVariable = PluginVariable(
+    id="tapmap_workers",
+    name="Concurrent TAP lengths",
+    description="Maximum number of tapmat_pred_fsa processes (one per peptide length) running at the same time",
+    type=VariableTypes.INTEGER,  # type: ignore
+    defaultValue=7,
+)
+
+netcleaveWorkersVariable = PluginVariable(
+    id="netcleave_workers",
+    name="Concurrent NetCleave shards",
+    description="In FASTA mode, the proteins are split into this many shards of similar total length, each scored by its own NetCleave process",
+    type=VariableTypes.INTEGER,  # type: ignore
+    defaultValue=4,
+)
+
+shardSizeVariable = PluginVariable(
+    id="batch_shard_size",
+    name="Batch shard size",
+    description="Submissions with more queries (CSV rows or fasta records) than this run in batch mode, split into shards of this size",
+    type=VariableTypes.INTEGER,  # type: ignore
+    defaultValue=500,
+)
+
+batchWorkersVariable = PluginVariable(
+    id="batch_workers",
+    name="Concurrent shards",
+    description="Maximum number of batch shards running the PredIG pipeline at the same time",
+    type=VariableTypes.INTEGER,  # type: ignore
+    defaultValue=2,
+)
+
+xgboostThreadsVariable = PluginVariable(
+    id="xgboost_threads",
+    name="XGBoost threads",
+    description="Number of threads used to score with the PredIG model, 0 uses every core",
+    type=VariableTypes.INTEGER,  # type: ignore
+    defaultValue=0,
+)
+
+scratchDirVariable = PluginVariable(
+    id="scratch_dir",
+    name="Scratch folder",
+    description="Folder where every stage creates its own scratch directory for the tool input and output files, e.g. /dev/shm to keep them on tmpfs. Empty uses the system temporary folder",
+    type=VariableTypes.STRING,  # type: ignore
+    defaultValue="",
+)
+
+toolIOVariable = PluginVariable(
+    id="tool_io",
+    name="Tool input/output",
+    description="How tapmat_pred_fsa and mhcflurry-predict exchange data: through files in the scratch folder or through pipes (stdin/stdout, the tools read /dev/stdin). NetCleave, PCH and NOAH always use files",
+    type=VariableTypes.STRING_LIST,  # type: ignore
+    defaultValue="files",
+    allowedValues=["files", "pipes"],
+)
+
+pairChunkSizeVariable = PluginVariable(
+    id="pair_chunk_size",
+    name="Pair chunk size",
+    description="Maximum number of epitope/allele rows materialised at once when sending pairs to MHCflurry and NOAH, joining, scoring and writing the results. Bounds the memory of the FASTA mode, where every k-mer is crossed with every allele",
+    type=VariableTypes.INTEGER,  # type: ignore
+    defaultValue=250000,
+)
+
+# Create a plugin configuration for the parallel execution
+parallelConfig = PluginConfig(
+    name="Parallel execution",
+    description="Configure how many external tools PredIG runs concurrently",
+    variables=[
+        stageWorkersVariable,
+        tapmapWorkersVariable,
+        netcleaveWorkersVariable,
+        shardSizeVariable,
+        batchWorkersVariable,
+        xgboostThreadsVariable,
+        scratchDirVariable,
+        toolIOVariable,
+        pairChunkSizeVariable,
+    ],
+)
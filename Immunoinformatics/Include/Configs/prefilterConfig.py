@@ -0,0 +1,37 @@
+from HorusAPI import PluginConfig, PluginVariable, VariableTypes
+
+prefilterVariable = PluginVariable(
+    id="prefilter",
+    name="Cascade pre-filter",
+    description="Run MHCflurry first and send only the epitope/allele pairs passing the cutoff to NOAH, PCH, TAP and the PredIG model. The pruned pairs are reported without scores and flagged in the Pruned column",
+    type=VariableTypes.STRING_LIST,  # type: ignore
+    defaultValue="off",
+    allowedValues=["off", "affinity percentile", "presentation score"],
+)
+
+maxPercentileVariable = PluginVariable(
+    id="prefilter_max_percentile",
+    name="Maximum affinity percentile",
+    description="Pairs with a higher mhcflurry_affinity_percentile are pruned (affinity percentile pre-filter)",
+    type=VariableTypes.FLOAT,  # type: ignore
+    defaultValue=2.0,
+)
+
+minPresentationVariable = PluginVariable(
+    id="prefilter_min_presentation",
+    name="Minimum presentation score",
+    description="Pairs with a lower mhcflurry_presentation_score are pruned (presentation score pre-filter)",
+    type=VariableTypes.FLOAT,  # type: ignore
+    defaultValue=0.5,
+)
+
+# Create a plugin configuration for the cascade pre-filter
+prefilterConfig = PluginConfig(
+    name="Cascade pre-filter",
+    description="Prune the unlikely binders with MHCflurry before running the other PredIG tools",
+    variables=[
+        prefilterVariable,
+        maxPercentileVariable,
+        minPresentationVariable,
+    ],
+)
@@ -1,4 +1,7 @@
 import os
+import re
+import threading
+from collections import OrderedDict
 from HorusAPI import PluginPage, PluginEndpoint
 import typing
 
@@ -11,9 +14,90 @@ results_page = PluginPage(
 )
 
 
+# Parsed results CSVs, invalidated when the file changes on disk
+_results_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_results_cache_lock = threading.Lock()
+_RESULTS_CACHE_SIZE = 4
+
+_FILTER_PATTERN = re.compile(r"^\s*(.+?)\s*(>=|<=|==|!=|>|<|~)\s*(.*?)\s*$")
+
+
+def _load_results(full_csv: str):
+    """
+    Return the parsed results CSV, reusing the parsed DataFrame while the
+    file path, modification time and size do not change
+    """
+
+    import pandas as pd
+
+    stat = os.stat(full_csv)
+    key = os.path.realpath(full_csv)
+
+    with _results_cache_lock:
+        cached = _results_cache.get(key)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            _results_cache.move_to_end(key)
+            return cached[2]
+
+    df = pd.read_csv(full_csv)
+
+    with _results_cache_lock:
+        _results_cache[key] = (stat.st_mtime_ns, stat.st_size, df)
+        _results_cache.move_to_end(key)
+        while len(_results_cache) > _RESULTS_CACHE_SIZE:
+            _results_cache.popitem(last=False)
+
+    return df
+
+
+def _apply_filter(df, condition: str):
+    """
+    Filter the results with a condition like 'PredIG>0.5',
+    'HLA_allele==HLA-A*02:01' or 'epitope~KLL' (contains)
+    """
+
+    import pandas as pd
+
+    match = _FILTER_PATTERN.match(condition)
+    if not match:
+        raise ValueError(f"Invalid filter '{condition}'")
+
+    column, operator, value = match.groups()
+    if column not in df.columns:
+        raise ValueError(f"Unknown filter column '{column}'")
+
+    series = df[column]
+    if operator == "~":
+        return df[series.astype(str).str.contains(value, regex=False, na=False)]
+
+    target: typing.Any = value
+    if pd.api.types.is_numeric_dtype(series):
+        target = float(value)
+    elif operator not in ("==", "!="):
+        raise ValueError(f"Column '{column}' is not numeric")
+
+    if operator == ">=":
+        return df[series >= target]
+    if operator == "<=":
+        return df[series <= target]
+    if operator == ">":
+        return df[series > target]
+    if operator == "<":
+        return df[series < target]
+    if operator == "==":
+        return df[series == target]
+    return df[series != target]
+
+
 def return_data():
+    """
+    Return the results CSV as JSON records. Optional query parameters:
+    offset and limit for paging, sort and order (asc or desc) for sorting
+    and any number of filter conditions (see _apply_filter). The response
+    also lists the numeric columns and the total and filtered row counts.
+    """
 
-    from flask import request, Response, send_file, jsonify
+    from flask import request, Response, jsonify
 
     data: dict = request.args
 
@@ -42,18 +126,59 @@ def return_data():
     ):
         return Response("Results do not exist", status=400)
 
-    import pandas as pd
-    import numpy as np
-
     try:
-        df = pd.read_csv(full_csv)
-
-        # Replace all NAN values with None
-        df = df.replace({np.nan: None})
-
-        data_dict = df.to_dict(orient="records")
-
-        return jsonify({"ok": True, "results": data_dict, "columns": list(df.columns)})
+        import pandas as pd
+
+        df = _load_results(full_csv)
+        total = len(df)
+
+        # The page picks the number or text filter of each column
+        numeric = [
+            column
+            for column in df.columns
+            if pd.api.types.is_numeric_dtype(df[column])
+        ]
+
+        for condition in request.args.getlist("filter"):
+            df = _apply_filter(df, condition)
+
+        sort: typing.Union[str, None] = data.get("sort")
+        if sort:
+            if sort not in df.columns:
+                return Response(f"Unknown sort column '{sort}'", status=400)
+            df = df.sort_values(
+                sort,
+                ascending=data.get("order", "asc") != "desc",
+                kind="stable",
+                na_position="last",
+            )
+
+        filtered = len(df)
+        offset = max(0, int(data.get("offset", 0)))
+        limit = data.get("limit")
+        if limit is not None and limit != "":
+            df = df.iloc[offset : offset + max(0, int(limit))]
+        else:
+            df = df.iloc[offset:]
+
+        import numpy as np
+
+        # Replace the NAN values with None, only for the returned page
+        page = df.replace({np.nan: None})
+
+        data_dict = page.to_dict(orient="records")
+
+        return jsonify(
+            {
+                "ok": True,
+                "results": data_dict,
+                "columns": list(df.columns),
+                "numeric": numeric,
+                "total": total,
+                "filtered": filtered,
+                "offset": offset,
+            }
+        )
 
     except Exception as e:
         return Response(str(e), status=400)
@@ -66,8 +191,139 @@ results_data_endpoint = PluginEndpoint(
 results_page.addEndpoint(results_data_endpoint)
 
 
+class _ZipStream:
+    """
+    Write-only file object collecting the bytes produced by zipfile, so they
+    can be yielded to the client while the archive is being built
+    """
+
+    def __init__(self):
+        self.chunks: typing.List[bytes] = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _folder_files(folder: str) -> typing.List[str]:
+    files = []
+    for root, dirs, filenames in os.walk(folder):
+        dirs.sort()
+        for filename in sorted(filenames):
+            files.append(os.path.join(root, filename))
+    return files
+
+
+def _folder_fingerprint(folder: str) -> str:
+    """
+    Hash of the relative path, size and modification time of every file
+    """
+
+    import hashlib
+
+    digest = hashlib.sha256()
+    for path in _folder_files(folder):
+        stat = os.stat(path)
+        relative = os.path.relpath(path, folder)
+        digest.update(f"{relative}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def _cached_zip_path(folder: str, fingerprint: str) -> str:
+    folder_name = os.path.basename(folder)
+    return os.path.join(os.path.dirname(folder), f".{folder_name}.{fingerprint}.zip")
+
+
+def _cached_zips(folder: str) -> typing.List[str]:
+    import glob
+
+    folder_name = os.path.basename(folder)
+    pattern = os.path.join(
+        glob.escape(os.path.dirname(folder)),
+        glob.escape(f".{folder_name}.") + "*.zip",
+    )
+    return glob.glob(pattern)
+
+
+def _prune_cached_zips(folder: str, keep: typing.Optional[str] = None):
+    """
+    Remove the archives cached for older versions of the folder
+    """
+
+    for stale in _cached_zips(folder):
+        if stale != keep:
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                # Pruned at the same time by another download
+                pass
+
+
+_ZIP_BLOCK_SIZE = 1 << 20
+
+
+def _stream_zip(folder: str, fingerprint: str, cached_zip: str):
+    """
+    Yield the zip of the folder while it is built. Every file is compressed
+    block by block, the compressed bytes are yielded after each block. They
+    are also written to a partial file that becomes the cached archive once
+    complete.
+    """
+
+    import zipfile
+
+    partial = f"{cached_zip}.{os.getpid()}.{threading.get_ident()}.partial"
+    stream = _ZipStream()
+    completed = False
+
+    try:
+        with open(partial, "wb") as cache_file:
+            with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+                for path in _folder_files(folder):
+                    info = zipfile.ZipInfo.from_file(
+                        path, os.path.relpath(path, folder)
+                    )
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    with open(path, "rb") as source:
+                        with archive.open(info, "w") as member:
+                            for block in iter(
+                                lambda: source.read(_ZIP_BLOCK_SIZE), b""
+                            ):
+                                member.write(block)
+                                data = stream.pop()
+                                if data:
+                                    cache_file.write(data)
+                                    yield data
+
+                    # The member header and sizes are written when it closes
+                    data = stream.pop()
+                    cache_file.write(data)
+                    yield data
+
+            # The central directory is written when the archive is closed
+            data = stream.pop()
+            cache_file.write(data)
+            yield data
+        completed = True
+    finally:
+        # Only keep the archive if the folder did not change while zipping
+        if completed and _folder_fingerprint(folder) == fingerprint:
+            _prune_cached_zips(folder)
+            os.replace(partial, cached_zip)
+        elif os.path.exists(partial):
+            os.remove(partial)
+
+
 def download_results():
-    from flask import request, Response, send_file, after_this_request
+    from flask import request, Response, send_file, stream_with_context
 
     data: dict = request.args
 
@@ -98,43 +354,37 @@ def download_results():
     ):
         return Response("CSV does not exist", status=400)
 
-    import pandas as pd
-
-    download_name: typing.Union[str, None] = None
     if simulation:
         folder_to_download = os.path.dirname(full_csv)
         folder_name = os.path.basename(folder_to_download)
-        full_zip_path = os.path.join(os.path.dirname(folder_to_download), folder_name)
-        full_zip_path_with_extension = full_zip_path + ".zip"
-
-        # Compress the folder
-        if os.path.exists(full_zip_path_with_extension):
-            os.remove(full_zip_path_with_extension)
-
-        import shutil
-
-        os.chdir(folder_to_download)
-        shutil.make_archive(
-            full_zip_path,
-            "zip",
-            root_dir=folder_to_download,
+        download_name = (name if name else folder_name) + ".zip"
+
+        fingerprint = _folder_fingerprint(folder_to_download)
+        cached_zip = _cached_zip_path(folder_to_download, fingerprint)
+
+        # Reuse the archive built by a previous download if nothing changed
+        if os.path.isfile(cached_zip):
+            return send_file(
+                cached_zip, as_attachment=True, download_name=download_name
+            )
+
+        # The folder changed, the archives of its older versions are stale
+        _prune_cached_zips(folder_to_download)
+
+        return Response(
+            stream_with_context(
+                _stream_zip(folder_to_download, fingerprint, cached_zip)
+            ),
+            mimetype="application/zip",
+            headers={
+                "Content-Disposition": f'attachment; filename="{download_name}"'
+            },
         )
 
-        download_name = name + ".zip" if name else None
-
-        full_zip_path = full_zip_path_with_extension
-
-        @after_this_request
-        def remove_file(response):
-            if os.path.exists(full_zip_path_with_extension):
-                os.remove(full_zip_path_with_extension)
-
-    else:
-        # Download the csv
-        full_zip_path = full_csv
-        download_name = name + ".csv" if name else None
+    # Download the csv
+    download_name = name + ".csv" if name else None
 
-    return send_file(full_zip_path, as_attachment=True, download_name=download_name)
+    return send_file(full_csv, as_attachment=True, download_name=download_name)
 
 
 download_results_endpoint = PluginEndpoint(
@@ -0,0 +1,123 @@
+"""
+Checkpoints of the PredIG pipeline stages.
+
+The output of every stage is saved in a checkpoint folder, keyed by a hash
+of the pipeline input, the parameters of the stage and the keys of the
+stages it depends on. When a run fails and is launched again, the stages
+with a valid checkpoint are restored instead of running their tool.
+"""
+
+import hashlib
+import json
+import os
+import typing
+
+import pandas as pd
+
+from feature_store import loadFeatures, saveFeatures
+from scheduler import Stage
+
+
+def inputDigest(
+    df: typing.Optional[pd.DataFrame] = None, fasta: typing.Optional[str] = None
+) -> str:
+    """
+    sha256 of the pipeline input: the CSV rows or the fasta file content
+    """
+
+    digest = hashlib.sha256()
+    if df is not None:
+        digest.update(json.dumps(list(map(str, df.columns))).encode())
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    if fasta is not None:
+        with open(fasta, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class CheckpointStore:
+    """
+    Folder holding one columnar file per checkpointed stage output
+    """
+
+    def __init__(self, folder: str):
+        self.folder = os.path.abspath(folder)
+        os.makedirs(self.folder, exist_ok=True)
+
+    def path(self, name: str, key: str) -> str:
+        return os.path.join(self.folder, f"{name}-{key[:32]}.npz")
+
+    def load(self, name: str, key: str) -> typing.Optional[pd.DataFrame]:
+        """
+        Output of the stage for the key, None when missing or unreadable
+        """
+
+        path = self.path(name, key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            return loadFeatures(path)
+        except ValueError as e:
+            print(f"Ignoring the checkpoint of stage '{name}': {e}")
+            return None
+
+    def save(self, name: str, key: str, df: pd.DataFrame):
+        # Written aside and renamed, a crash never leaves a partial checkpoint
+        path = self.path(name, key)
+        partial = path + ".partial"
+        saveFeatures(partial, df)
+        os.replace(partial, path)
+
+
+def checkpointStages(
+    stages: typing.List[Stage],
+    store: CheckpointStore,
+    stage_params: typing.Dict[str, dict],
+    input_digest: str,
+    keys: typing.Optional[typing.Dict[str, str]] = None,
+) -> typing.List[Stage]:
+    """
+    Wrap the stage actions so their outputs are restored from, or saved to,
+    the store. The key of a stage covers the input, its stage_params entry
+    and the keys of its dependencies.
+
+    keys holds the keys of stages wrapped by an earlier call, which the
+    stages can depend on. The keys of the wrapped stages are added to it.
+    """
+
+    by_name = {stage.name: stage for stage in stages}
+    if keys is None:
+        keys = {}
+
+    def stageKey(name: str) -> str:
+        if name not in keys:
+            payload = [
+                name,
+                stage_params.get(name, {}),
+                input_digest,
+                [stageKey(d) for d in sorted(by_name[name].dependencies)],
+            ]
+            keys[name] = hashlib.sha256(
+                json.dumps(payload, sort_keys=True, default=str).encode()
+            ).hexdigest()
+        return keys[name]
+
+    def wrap(stage: Stage, key: str):
+        def action(results: dict):
+            output = store.load(stage.name, key)
+            if output is not None:
+                print(f"Stage '{stage.name}' restored from its checkpoint")
+                return output
+
+            output = stage.action(results)
+            if isinstance(output, pd.DataFrame):
+                store.save(stage.name, key, output)
+            return output
+
+        return action
+
+    return [
+        Stage(stage.name, wrap(stage, stageKey(stage.name)), stage.dependencies)
+        for stage in stages
+    ]
@@ -0,0 +1,139 @@
+"""
+Columnar store of the joined PredIG features of a run.
+
+Every column of the joined frame (the epitope/allele keys, the 13 model
+features and the descriptive tool outputs) is saved as its own array in a
+compressed .npz file. A later run can load it and rescore with another
+model or threshold without running any of the external tools again.
+
+Large runs are written chunk by chunk with a FeatureWriter.
+"""
+
+import os
+import shutil
+import tempfile
+import typing
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+FEATURES_VERSION = 1
+
+
+def _columnArray(values: pd.Series) -> np.ndarray:
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=np.float64)
+    # Missing strings are stored empty, they are restored as NaN
+    return values.to_numpy(dtype=str, na_value="")
+
+
+def _concatenate(parts: typing.List[np.ndarray]) -> np.ndarray:
+    # A column numeric in some chunks only (e.g. all missing) is stored as text
+    if any(part.dtype.kind == "U" for part in parts):
+        parts = [
+            part
+            if part.dtype.kind == "U"
+            else np.where(np.isnan(part), "", part.astype(str))
+            for part in parts
+        ]
+    return np.concatenate(parts)
+
+
+class FeatureWriter:
+    """
+    Write the joined frame chunk by chunk. The chunk columns are spilled
+    to a folder next to the file and gathered one column at a time on
+    close, so the whole frame is never held in memory.
+
+    Used as a context manager, the file is written when the block ends and
+    the spilled chunks are discarded when it raises.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.columns: typing.Optional[typing.List[str]] = None
+        self.chunks = 0
+        self.parts = tempfile.mkdtemp(
+            prefix="predig_features_", dir=os.path.dirname(os.path.abspath(path))
+        )
+
+    def append(self, df: pd.DataFrame):
+        if self.columns is None:
+            self.columns = list(df.columns)
+        for i, column in enumerate(self.columns):
+            np.save(
+                os.path.join(self.parts, f"c{i}_{self.chunks}.npy"),
+                _columnArray(df[column]),
+                allow_pickle=False,
+            )
+        self.chunks += 1
+
+    def __enter__(self) -> "FeatureWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def discard(self):
+        shutil.rmtree(self.parts, ignore_errors=True)
+
+    def close(self):
+        columns = self.columns or []
+        arrays = {
+            "__columns__": lambda: np.array(columns, dtype=str),
+            "__version__": lambda: np.array([FEATURES_VERSION]),
+        }
+        for i in range(len(columns)):
+            arrays[f"c{i}"] = lambda i=i: _concatenate(
+                [
+                    np.load(os.path.join(self.parts, f"c{i}_{chunk}.npy"))
+                    for chunk in range(self.chunks)
+                ]
+            )
+
+        # Same layout as np.savez_compressed, one member per array
+        try:
+            with zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED) as f:
+                for name, array in arrays.items():
+                    with f.open(name + ".npy", "w", force_zip64=True) as member:
+                        np.lib.format.write_array(member, array(), allow_pickle=False)
+        finally:
+            self.discard()
+
+
+def saveFeatures(path: str, df: pd.DataFrame):
+    """
+    Save the joined frame column by column in a compressed .npz file
+    """
+
+    with FeatureWriter(path) as writer:
+        writer.append(df)
+
+
+def loadFeatures(path: str) -> pd.DataFrame:
+    """
+    Load a frame saved with saveFeatures
+    """
+
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            version = int(data["__version__"][0])
+            if version != FEATURES_VERSION:
+                raise ValueError(f"unsupported version {version}")
+
+            columns = [str(column) for column in data["__columns__"]]
+            df = pd.DataFrame(
+                {column: data[f"c{i}"] for i, column in enumerate(columns)}
+            )
+    except Exception as e:
+        raise ValueError(f"The features file {path} is not valid: {e}")
+
+    for column in df.columns:
+        if not pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = df[column].astype(object).replace("", np.nan)
+
+    return df
@@ -0,0 +1,214 @@
+"""
+Keyed join of the tool outputs on integer encoded (epitope, allele) codes.
+
+The epitopes and alleles of the input rows are factorized once. Every tool
+output is then located through its codes (epitope code, or epitope and
+allele codes combined in a single int64) and gathered in the row order of
+the input, whatever order, duplicates or missing rows the tool returned.
+All the outputs are attached in a single concatenation instead of a chain
+of merges.
+"""
+
+import typing
+
+import numpy as np
+import pandas as pd
+
+
+class KeyCodes:
+    """
+    Integer codes of the epitopes and alleles of the input rows
+    """
+
+    def __init__(self, epitopes: pd.Series, alleles: pd.Series):
+        epitope_codes, self.epitopes = pd.factorize(epitopes.astype(str))
+        allele_codes, self.alleles = pd.factorize(alleles.astype(str))
+
+        self.epitope_codes = epitope_codes.astype(np.int64)
+        self.allele_codes = allele_codes.astype(np.int64)
+        self.pair_codes = self.epitope_codes * len(self.alleles) + self.allele_codes
+
+    @classmethod
+    def fromCodes(
+        cls,
+        epitopes: pd.Index,
+        alleles: pd.Index,
+        epitope_codes: np.ndarray,
+        allele_codes: np.ndarray,
+    ) -> "KeyCodes":
+        """
+        KeyCodes of rows already encoded against known epitopes and alleles
+        """
+
+        keys = cls.__new__(cls)
+        keys.epitopes = epitopes
+        keys.alleles = alleles
+        keys.epitope_codes = epitope_codes.astype(np.int64)
+        keys.allele_codes = allele_codes.astype(np.int64)
+        keys.pair_codes = keys.epitope_codes * len(alleles) + keys.allele_codes
+        return keys
+
+    def encodeEpitopes(self, epitopes: pd.Series) -> np.ndarray:
+        """
+        Codes of the epitopes, -1 for epitopes not in the input
+        """
+
+        return pd.Index(self.epitopes).get_indexer(epitopes.astype(str))
+
+    def encodePairs(self, epitopes: pd.Series, alleles: pd.Series) -> np.ndarray:
+        """
+        Codes of the (epitope, allele) pairs, -1 for pairs not in the input
+        """
+
+        epitope_codes = self.encodeEpitopes(epitopes).astype(np.int64)
+        allele_codes = pd.Index(self.alleles).get_indexer(alleles.astype(str))
+        codes = epitope_codes * len(self.alleles) + allele_codes
+        codes[(epitope_codes < 0) | (allele_codes < 0)] = -1
+        return codes
+
+
+class KeyedJoin:
+    """
+    Tool outputs prepared once for joins on the codes of a KeyCodes, so
+    chunks of input rows can be joined one after the other
+    """
+
+    def __init__(
+        self,
+        keys: KeyCodes,
+        outputs: typing.List[typing.Tuple[pd.DataFrame, typing.List[str], str]],
+    ):
+        self.keys = keys
+        self.outputs = [self._prepare(*output) for output in outputs]
+
+    def _prepare(
+        self, output: pd.DataFrame, key_columns: typing.List[str], suffix: str
+    ) -> tuple:
+        # A tool that scored nothing may return a frame without columns
+        missing = [column for column in key_columns if column not in output]
+        if missing:
+            if len(output) > 0:
+                raise KeyError(f"The output has no {missing} columns")
+            output = output.reindex(columns=list(output.columns) + missing)
+
+        values = output.drop(columns=key_columns).reset_index(drop=True)
+        rows = np.arange(len(output), dtype=np.int64)
+
+        if len(key_columns) == 1:
+            codes = self.keys.encodeEpitopes(output[key_columns[0]])
+            # Dense lookup table over the epitope codes, the first row wins
+            lookup = np.full(len(self.keys.epitopes), -1, dtype=np.int64)
+            found = codes >= 0
+            lookup[codes[found][::-1]] = rows[found][::-1]
+            return (values, suffix, lookup, None)
+
+        codes = self.keys.encodePairs(output[key_columns[0]], output[key_columns[1]])
+        codes = pd.Series(codes)
+        unique = codes[(codes >= 0) & ~codes.duplicated()]
+        # The Index keeps its hash table between the chunks
+        index = pd.Index(unique.values)
+        return (values, suffix, index, unique.index.values)
+
+    def withOutputs(
+        self,
+        outputs: typing.Dict[int, typing.Tuple[pd.DataFrame, typing.List[str], str]],
+    ) -> "KeyedJoin":
+        """
+        Copy of the join with the outputs at the given positions replaced,
+        the other outputs are not prepared again
+        """
+
+        join = KeyedJoin.__new__(KeyedJoin)
+        join.keys = self.keys
+        join.outputs = list(self.outputs)
+        for position, output in outputs.items():
+            join.outputs[position] = self._prepare(*output)
+        return join
+
+    def join(
+        self,
+        base: pd.DataFrame,
+        epitope_codes: np.ndarray,
+        allele_codes: np.ndarray,
+    ) -> pd.DataFrame:
+        """
+        Attach the outputs to the base rows, whose epitope and allele codes
+        are given. Rows without a match get NaN.
+        """
+
+        columns = list(base.columns)
+        parts = [base.reset_index(drop=True)]
+
+        for values, suffix, lookup, rows in self.outputs:
+            if rows is None:
+                positions = lookup[epitope_codes]
+            else:
+                pair_codes = epitope_codes * len(self.keys.alleles) + allele_codes
+                positions = lookup.get_indexer(pair_codes)
+                found = positions >= 0
+                positions[found] = rows[positions[found]]
+
+            joined = values.reindex(positions).reset_index(drop=True)
+            joined.columns = [
+                f"{column}{suffix}" if column in columns else column
+                for column in joined.columns
+            ]
+            columns.extend(joined.columns)
+            parts.append(joined)
+
+        return pd.concat(parts, axis=1)
+
+
+class PairProduct:
+    """
+    Lazy cross product of the NetCleave rows (epitope and score of every
+    fasta k-mer) with the HLA alleles.
+
+    Only the epitope codes of the rows and the allele list are kept; the
+    (epitope, allele) rows are materialised in chunks of bounded size, in
+    the same allele-major order as a full expansion.
+    """
+
+    def __init__(self, rows: pd.DataFrame, alleles: typing.List[str]):
+        epitope_codes, epitopes = pd.factorize(rows["epitope"].astype(str))
+        self.epitopes = pd.Index(epitopes)
+        self.alleles = pd.Index(alleles)
+        self.epitope_codes = epitope_codes.astype(np.int64)
+        self.netcleave = rows["netcleave"].to_numpy()
+
+    def __len__(self) -> int:
+        return len(self.epitope_codes) * len(self.alleles)
+
+    def keys(self) -> KeyCodes:
+        """
+        KeyCodes over the epitopes and alleles of the product, the rows are
+        encoded chunk by chunk (see chunks)
+        """
+
+        empty = np.zeros(0, dtype=np.int64)
+        return KeyCodes.fromCodes(self.epitopes, self.alleles, empty, empty)
+
+    def chunks(
+        self, chunk_size: int
+    ) -> typing.Iterator[typing.Tuple[pd.DataFrame, np.ndarray, np.ndarray]]:
+        """
+        The rows of the product (epitope, hla_allele, netcleave) with their
+        epitope and allele codes, at most chunk_size rows at a time
+        """
+
+        rows = len(self.epitope_codes)
+        total = len(self)
+        chunk_size = max(1, int(chunk_size))
+        for start in range(0, max(total, 1), chunk_size):
+            flat = np.arange(start, min(start + chunk_size, total), dtype=np.int64)
+            row = flat % max(rows, 1)
+            epitope_codes = self.epitope_codes[row]
+            allele_codes = flat // max(rows, 1)
+            base = pd.DataFrame(
+                {
+                    "epitope": self.epitopes.take(epitope_codes),
+                    "hla_allele": self.alleles.take(allele_codes),
+                    "netcleave": self.netcleave[row],
+                }
+            )
+            yield base, epitope_codes, allele_codes
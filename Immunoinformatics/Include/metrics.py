@@ -0,0 +1,223 @@
+"""
+Stage level instrumentation of the PredIG pipeline.
+
+Every stage records its wall time, its input and output row counts and the
+resources of the tool processes it launched. The child processes are
+reaped with os.wait4 when they are waited for (see TrackedPopen), so their
+CPU time and peak RSS are attributed to the stage that started them, even
+when several stages run at the same time.
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import subprocess
+import threading
+import time
+import typing
+
+_current_stage: contextvars.ContextVar[typing.Optional["StageMetrics"]] = (
+    contextvars.ContextVar("predig_stage", default=None)
+)
+
+
+class StageMetrics:
+    """
+    Measurements of a single stage
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.wall_time = 0.0
+        self.rows_in: typing.Optional[int] = None
+        self.rows_out: typing.Optional[int] = None
+        self.processes = 0
+        self.child_user_time = 0.0
+        self.child_system_time = 0.0
+        self.child_peak_rss_kb = 0
+        self._lock = threading.Lock()
+
+    def recordUsage(self, usage):
+        """
+        Add the resource usage of a finished child process
+        """
+
+        with self._lock:
+            self.processes += 1
+            self.child_user_time += usage.ru_utime
+            self.child_system_time += usage.ru_stime
+            # ru_maxrss is in KB on Linux, it also covers the forked copy of
+            # this process before the exec of the tool
+            self.child_peak_rss_kb = max(self.child_peak_rss_kb, usage.ru_maxrss)
+
+    def toDict(self) -> dict:
+        return {
+            "wall_time": round(self.wall_time, 4),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "processes": self.processes,
+            "child_user_time": round(self.child_user_time, 4),
+            "child_system_time": round(self.child_system_time, 4),
+            "child_peak_rss_kb": self.child_peak_rss_kb,
+        }
+
+
+class TrackedPopen(subprocess.Popen):
+    """
+    Popen reaping the child with os.wait4 when it is waited for, the
+    resource usage of the child is added to the stage running in the
+    current context. Waits with a timeout are left to Popen and not tracked.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._stage = _current_stage.get()
+        super().__init__(*args, **kwargs)
+
+    def wait(self, timeout=None):
+        if self.returncode is None and timeout is None:
+            try:
+                (pid, sts, usage) = os.wait4(self.pid, 0)
+            except ChildProcessError:
+                # Already reaped by a poll, Popen knows its return code
+                pid = None
+
+            if pid == self.pid:
+                self.returncode = os.waitstatus_to_exitcode(sts)
+                if self._stage is not None:
+                    self._stage.recordUsage(usage)
+
+        return super().wait(timeout)
+
+
+def recordRowsIn(rows: int):
+    """
+    Add to the input rows of the stage running in the current context, a
+    stage running once per chunk counts the rows of every chunk
+    """
+
+    stage = _current_stage.get()
+    if stage is not None:
+        stage.rows_in = (stage.rows_in or 0) + int(rows)
+
+
+def _rowCount(value) -> typing.Optional[int]:
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+class RunMetrics:
+    """
+    Metrics of every stage of a run, in the order the stages started
+    """
+
+    def __init__(self):
+        self.stages: typing.Dict[str, StageMetrics] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> typing.Iterator[StageMetrics]:
+        """
+        Time the block and attribute the child processes it starts to the
+        stage. The rows can be set on the yielded StageMetrics.
+        """
+
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = StageMetrics(name)
+            stage = self.stages[name]
+
+        token = _current_stage.set(stage)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.wall_time += time.perf_counter() - start
+            _current_stage.reset(token)
+
+    def instrument(
+        self, name: str, action: typing.Callable[[dict], typing.Any]
+    ) -> typing.Callable[[dict], typing.Any]:
+        """
+        Wrap a scheduler stage action, the output rows are the length of its
+        result. The action reports its input rows with recordRowsIn. An
+        action run several times adds up its measurements.
+        """
+
+        def instrumented(results: dict):
+            with self.stage(name) as stage:
+                output = action(results)
+                rows = _rowCount(output)
+                if rows is not None:
+                    stage.rows_out = (stage.rows_out or 0) + rows
+            return output
+
+        return instrumented
+
+    def toDict(self) -> dict:
+        return {name: stage.toDict() for name, stage in self.stages.items()}
+
+    def merge(self, other: dict):
+        """
+        Add the metrics of another run (e.g. a batch shard) to these ones
+        """
+
+        for name, values in other.items():
+            with self._lock:
+                if name not in self.stages:
+                    self.stages[name] = StageMetrics(name)
+                stage = self.stages[name]
+
+            stage.wall_time += values["wall_time"]
+            for key in ("rows_in", "rows_out"):
+                if values[key] is not None:
+                    setattr(stage, key, (getattr(stage, key) or 0) + values[key])
+            stage.processes += values["processes"]
+            stage.child_user_time += values["child_user_time"]
+            stage.child_system_time += values["child_system_time"]
+            stage.child_peak_rss_kb = max(
+                stage.child_peak_rss_kb, values["child_peak_rss_kb"]
+            )
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"stages": self.toDict()}, f, indent=2)
+
+    def summary(self) -> str:
+        """
+        The metrics as a plain text table for the block log
+        """
+
+        header = (
+            "Stage",
+            "Wall (s)",
+            "Rows in",
+            "Rows out",
+            "Child CPU (s)",
+            "Peak RSS (MB)",
+        )
+        rows = [header]
+        for stage in self.stages.values():
+            rows.append(
+                (
+                    stage.name,
+                    f"{stage.wall_time:.2f}",
+                    "-" if stage.rows_in is None else str(stage.rows_in),
+                    "-" if stage.rows_out is None else str(stage.rows_out),
+                    f"{stage.child_user_time + stage.child_system_time:.2f}",
+                    f"{stage.child_peak_rss_kb / 1024:.1f}",
+                )
+            )
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        lines = [
+            "  ".join(
+                cell.ljust(width) if i == 0 else cell.rjust(width)
+                for i, (cell, width) in enumerate(zip(row, widths))
+            )
+            for row in rows
+        ]
+        lines.insert(1, "-" * len(lines[0]))
+        return "\n".join(lines)
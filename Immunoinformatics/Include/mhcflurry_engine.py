@@ -0,0 +1,108 @@
+"""
+In-process MHCflurry engine.
+
+The presentation predictor is loaded once and kept resident in the process,
+so repeated runs skip the TensorFlow import, the model loading and the CSV
+round trip of mhcflurry-predict.
+"""
+
+import threading
+import typing
+
+import pandas as pd
+
+_predictors: typing.Dict[typing.Optional[str], typing.Any] = {}
+_load_lock = threading.Lock()
+_predict_lock = threading.Lock()
+
+# Same columns (and order) mhcflurry-predict writes with --always-include-best-allele
+PREDICTION_COLUMNS = [
+    "affinity",
+    "best_allele",
+    "affinity_percentile",
+    "processing_score",
+    "presentation_score",
+    "presentation_percentile",
+]
+
+
+def engineVersion() -> str:
+    """
+    Version of the installed mhcflurry package, used to key cached scores
+    """
+
+    from importlib.metadata import version
+
+    return f"mhcflurry=={version('mhcflurry')}"
+
+
+def getPresentationPredictor(models_dir: typing.Optional[str] = None):
+    """
+    Return the resident presentation predictor, loading it on first use
+    """
+
+    with _load_lock:
+        if models_dir not in _predictors:
+            from mhcflurry import Class1PresentationPredictor
+
+            print("Loading the MHCflurry presentation predictor")
+            _predictors[models_dir] = Class1PresentationPredictor.load(models_dir)
+
+        return _predictors[models_dir]
+
+
+def predictMHCflurry(
+    df_csv: pd.DataFrame, models_dir: typing.Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Score a batch of peptide/allele pairs with the resident predictor.
+
+    Returns the same columns as runPredigMHCflurry: epitope, hla_allele and
+    the mhcflurry_* predictions, one row per input row.
+    """
+
+    if "peptide" not in df_csv.columns and "epitope" not in df_csv.columns:
+        raise ValueError(
+            "The input CSV file must contain 'peptide' or 'epitope' column."
+        )
+    if "HLA_allele" not in df_csv.columns and "allele" not in df_csv.columns:
+        raise ValueError(
+            "The input CSV file must contain 'allele' or 'hla_allele' column."
+        )
+
+    if "hla_allele" in df_csv.columns:
+        df_csv = df_csv.rename(columns={"hla_allele": "allele"})
+    if "HLA_allele" in df_csv.columns:
+        df_csv = df_csv.rename(columns={"HLA_allele": "allele"})
+    if "epitope" in df_csv.columns:
+        df_csv = df_csv.rename(columns={"epitope": "peptide"})
+
+    df = df_csv[["peptide", "allele"]].reset_index(drop=True)
+
+    predictor = getPresentationPredictor(models_dir)
+
+    # Every row is its own sample, genotyped with the allele of the row
+    genotypes = {allele: [allele] for allele in df["allele"].unique()}
+
+    try:
+        # The predictor is shared between the pipeline threads
+        with _predict_lock:
+            predictions = predictor.predict(
+                peptides=df["peptide"].tolist(),
+                alleles=genotypes,
+                sample_names=df["allele"].tolist(),
+                include_affinity_percentile=True,
+                verbose=0,
+                throw=False,
+            )
+    except Exception as e:
+        raise Exception(
+            f"An error occurred while running the MHCflurry engine: {e}"
+        )
+
+    predictions = predictions.sort_values("peptide_num").reset_index(drop=True)
+
+    for column in PREDICTION_COLUMNS:
+        df[f"mhcflurry_{column}"] = predictions[column].values
+
+    return df.rename(columns={"allele": "hla_allele", "peptide": "epitope"})
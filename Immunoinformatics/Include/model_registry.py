@@ -0,0 +1,120 @@
+"""
+Process-wide registry of the PredIG XGBoost models.
+
+Each model file is loaded once and kept keyed by its path and checksum, so
+later runs reuse the booster unless the file changes. Scoring predicts in
+place from a contiguous float32 array, in chunks.
+
+The module is imported when the plugin registers its blocks, so NumPy,
+pandas and XGBoost are only imported once a model is used.
+"""
+
+import hashlib
+import os
+import threading
+import typing
+
+if typing.TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+PREDIG_MODELS = {
+    "PredIG-NeoA": "/home/perry/data/Programs/Immuno/Predig/spw_xtreme_predig_model.model",
+    "PredIG-NonCan": "/home/perry/data/Programs/Immuno/Predig/spw_indep2_rescale_predig_model.model",
+    "PredIG-Path": "/home/perry/data/Programs/Immuno/Predig/spw_indep1_rescale_predig_model.model",
+}
+
+# Order of the features the PredIG models were trained with
+FEATURE_COLUMNS = [
+    "netcleave",
+    "NOAH",
+    "mw_peptide",
+    "mw_tcr_contact",
+    "hydroph_peptide",
+    "hydroph_tcr_contact",
+    "charge_peptide",
+    "charge_tcr_contact",
+    "stab_peptide",
+    "mhcflurry_affinity",
+    "mhcflurry_affinity_percentile",
+    "mhcflurry_processing_score",
+    "mhcflurry_presentation_score",
+]
+
+_boosters: typing.Dict[typing.Tuple[str, str], typing.Any] = {}
+_checksums: typing.Dict[typing.Tuple[str, int, int], str] = {}
+_lock = threading.Lock()
+
+
+def modelChecksum(path: str) -> str:
+    """
+    sha256 of the model file, only recomputed when its size or mtime change
+    """
+
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        if key in _checksums:
+            return _checksums[key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    with _lock:
+        _checksums[key] = digest.hexdigest()
+    return _checksums[key]
+
+
+def getBooster(path: str):
+    """
+    Return the loaded booster of the model file, loading it on first use
+    """
+
+    import xgboost as xgb
+
+    key = (os.path.realpath(path), modelChecksum(path))
+    with _lock:
+        if key not in _boosters:
+            print(f"Loading the PredIG model {path}")
+            booster = xgb.Booster()
+            booster.load_model(path)
+            _boosters[key] = booster
+        return _boosters[key]
+
+
+def featureMatrix(df: "pd.DataFrame") -> "np.ndarray":
+    """
+    Contiguous float32 matrix of the PredIG features, in training order
+    """
+
+    import numpy as np
+
+    return np.ascontiguousarray(df[FEATURE_COLUMNS].to_numpy(dtype=np.float32))
+
+
+def predictScores(
+    path: str,
+    features: "np.ndarray",
+    nthread: int = 0,
+    chunk_size: int = 65536,
+) -> "np.ndarray":
+    """
+    Score the feature matrix with the model, chunk by chunk.
+    nthread=0 lets XGBoost use every core.
+    """
+
+    import numpy as np
+
+    booster = getBooster(path)
+
+    with _lock:
+        booster.set_param({"nthread": int(nthread)})
+
+    scores = np.empty(features.shape[0], dtype=np.float32)
+    for start in range(0, features.shape[0], chunk_size):
+        chunk = features[start : start + chunk_size]
+        scores[start : start + chunk_size] = booster.inplace_predict(chunk)
+
+    return scores
@@ -0,0 +1,1029 @@
+"""
+Horus independent PredIG pipeline: runs the external tools, joins their
+outputs and scores the pHLA pairs with the PredIG XGBoost model.
+
+Large inputs are split into shards that run the whole pipeline in separate
+processes, their outputs are streamed into a single CSV.
+
+The joined features of a run can be saved and rescored later with another
+model or threshold, without running the tools again.
+
+In the FASTA mode the k-mer × allele cross product is never materialised
+whole: the pair level tools, the join, the scoring and the output file
+work on chunks of at most pair_chunk_size rows. Only the peptide level
+outputs (NetCleave, PCH and TAP) are kept for the whole run, the MHCflurry
+and NOAH scores of a chunk are dropped once it is written.
+"""
+
+import contextlib
+import contextvars
+import io
+import multiprocessing
+import os
+import shutil
+import typing
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import cast
+
+import numpy as np
+import pandas as pd
+
+from checkpoint import CheckpointStore, checkpointStages, inputDigest
+from feature_store import FeatureWriter, loadFeatures
+from join_engine import KeyCodes, KeyedJoin, PairProduct
+from metrics import RunMetrics, recordRowsIn
+from mhcflurry_engine import engineVersion, predictMHCflurry
+from model_registry import featureMatrix, predictScores
+from scheduler import Stage, runStages
+from scratch import scratchDir
+from score_cache import ScoreCache, runCached, toolVersion
+from utils import (
+    run_Predig_tapmap,
+    runPredigMHCflurry,
+    runPredigNetCleave,
+    runPredigNOAH,
+    runPredigPCH,
+)
+
+# Output columns of the tools besides their keys, kept when a tool has
+# nothing to score (e.g. no pair passed the cascade pre-filter)
+NETCLEAVE_COLUMNS = ["netcleave"]
+PCH_COLUMNS = [
+    "mw_peptide",
+    "mw_tcr_contact",
+    "hydroph_peptide",
+    "hydroph_tcr_contact",
+    "charge_peptide",
+    "charge_tcr_contact",
+    "stab_peptide",
+    "tcr_contact",
+]
+MHCFLURRY_COLUMNS = [
+    "mhcflurry_affinity",
+    "mhcflurry_affinity_percentile",
+    "mhcflurry_processing_score",
+    "mhcflurry_presentation_score",
+    "mhcflurry_presentation_percentile",
+    "mhcflurry_best_allele",
+]
+NOAH_COLUMNS = ["NOAH"]
+TAP_COLUMNS = ["TAP"]
+
+
+def readInput(
+    simulation: int, input_file: str
+) -> typing.Tuple[typing.Optional[pd.DataFrame], typing.Optional[str]]:
+    """
+    Load the input of a run: a DataFrame in the CSV modes or the path of the
+    fasta file in the FASTA mode
+    """
+
+    if not os.path.isfile(input_file):
+        raise ValueError("The input file is not valid")
+
+    if simulation == 1:
+        return None, input_file.replace('"', "").replace("'", "")
+
+    df = pd.read_csv(input_file)
+
+    # Replace cells that have "" or ''
+    df = df.replace('"', "")
+    df = df.replace("'", "")
+
+    # Verify that each row has the correct number of columns (all are filled)
+    column_lenght = df.shape[1]
+
+    for i, row in df.iterrows():
+        if len(row) != column_lenght:
+            raise ValueError(
+                "The input CSV file must contain the same number of columns in each row."
+            )
+
+    return df, None
+
+
+def stageParams(params: dict) -> typing.Dict[str, dict]:
+    """
+    Parameters that determine the output of each stage, used to key their
+    checkpoints
+    """
+
+    if params["mhcflurry_engine"] == "in-process":
+        mhcflurry_version = engineVersion()
+    else:
+        mhcflurry_version = toolVersion(params["mhcflurry_path"])
+
+    # The pre-filter decides which epitopes and pairs the later tools score
+    prefilter = {
+        "prefilter": params["prefilter"],
+        "max_percentile": params["prefilter_max_percentile"],
+        "min_presentation": params["prefilter_min_presentation"],
+    }
+
+    return {
+        "NetCleave": {
+            "version": toolVersion(params["netcleave_path"]),
+            "mode": params["simulation"],
+        },
+        "input": {"alleles": params["alleles"]},
+        "PCH": {
+            "version": toolVersion(params["pch_path"]),
+            "seed": int(params["seed"]),
+            "prefilter": prefilter,
+        },
+        "MHCflurry": {
+            "engine": params["mhcflurry_engine"],
+            "version": mhcflurry_version,
+        },
+        "NOAH": {
+            "version": toolVersion(params["noah_path"]),
+            "model": toolVersion(params["model"]),
+            "prefilter": prefilter,
+        },
+        "TAP": {
+            "version": toolVersion(params["tapmap_path"]),
+            "mat": toolVersion(params["mat"]),
+            "peptide_len": params["peptide_len"],
+            "alpha": params["alpha"],
+            "precursor_len": params["precursor_len"],
+            "prefilter": prefilter,
+        },
+    }
+
+
+def predictPredIG(
+    params: dict,
+    df: typing.Optional[pd.DataFrame] = None,
+    fasta: typing.Optional[str] = None,
+    features_file: typing.Optional[str] = None,
+    metrics: typing.Optional[RunMetrics] = None,
+) -> pd.DataFrame:
+    """
+    Run the PredIG pipeline in the current directory and return the results.
+    The joined features are saved to features_file when given and the stage
+    measurements are added to metrics.
+    """
+
+    chunks = predictPredIGChunks(
+        params, df=df, fasta=fasta, features_file=features_file, metrics=metrics
+    )
+    return pd.concat(list(chunks), ignore_index=True)
+
+
+def writePredIG(
+    params: dict,
+    output_file: str,
+    df: typing.Optional[pd.DataFrame] = None,
+    fasta: typing.Optional[str] = None,
+    features_file: typing.Optional[str] = None,
+    metrics: typing.Optional[RunMetrics] = None,
+) -> int:
+    """
+    Run the PredIG pipeline like predictPredIG, appending the results to
+    output_file chunk by chunk. Returns the number of rows written.
+    """
+
+    rows = 0
+    header = True
+    chunks = predictPredIGChunks(
+        params, df=df, fasta=fasta, features_file=features_file, metrics=metrics
+    )
+    with open(output_file, "w", encoding="utf-8", newline="") as output:
+        for chunk in chunks:
+            # Written with the first chunk, even when it has no rows
+            chunk.to_csv(output, index=False, header=header)
+            header = False
+            rows += len(chunk)
+
+    return rows
+
+
+def predictPredIGChunks(
+    params: dict,
+    df: typing.Optional[pd.DataFrame] = None,
+    fasta: typing.Optional[str] = None,
+    features_file: typing.Optional[str] = None,
+    metrics: typing.Optional[RunMetrics] = None,
+) -> typing.Iterator[pd.DataFrame]:
+    """
+    Run the PredIG pipeline in the current directory and yield the results
+    in chunks of at most pair_chunk_size rows
+    """
+
+    if metrics is None:
+        metrics = RunMetrics()
+
+    simulation = params["simulation"]
+    alleles = params["alleles"]
+    seed = params["seed"]
+    model = params["model"]
+    mat = params["mat"]
+    alpha = params["alpha"]
+    precursor_len = params["precursor_len"]
+    peptide_len = params["peptide_len"]
+    pchPath = params["pch_path"]
+    mhcflurryPath = params["mhcflurry_path"]
+    netCleavePath = params["netcleave_path"]
+    noahPath = params["noah_path"]
+    tapmat_pred_fsa_path = params["tapmap_path"]
+    python_exec = params["python_exec"]
+    tapmap_workers = params["tapmap_workers"]
+    scratch_root = params["scratch_dir"]
+    chunk_size = max(1, int(params["pair_chunk_size"]))
+    prefilter = params["prefilter"] != "off"
+
+    # Scores of previous runs are looked up before launching every tool
+    score_cache = None
+    if params["score_cache"]:
+        score_cache = ScoreCache(
+            params["score_cache_path"],
+            max_entries=params["score_cache_max_entries"],
+        )
+
+    def netcleave_stage(results: dict) -> pd.DataFrame:
+        print("Running NetCleave")
+        recordRowsIn(countQueries(df=df, fasta=fasta))
+        # Run the NetCleave / can be placed before to generate csv when case of Fasta
+        # When fasta set Hallele in input
+        if simulation == 1:
+            # The epitopes are generated from the fasta, nothing to look up
+            return runNetCleaveFasta(cast(str, fasta), params)
+
+        protein_column = "uniprot_id" if simulation == 2 else "protein_seq"
+        return runCached(
+            score_cache,
+            "NetCleave",
+            toolVersion(netCleavePath),
+            {"mode": simulation},
+            cast(pd.DataFrame, df),
+            ["epitope", protein_column],
+            lambda df_csv: runPredigNetCleave(
+                df_csv=df_csv,
+                predigNetcleave_path=netCleavePath,
+                mode=simulation,
+                python_exec=python_exec,
+            ),
+            output_columns=NETCLEAVE_COLUMNS,
+        )
+
+    def expand_stage(results: dict) -> PairProduct:
+        # If we are running with a fasta, cross the NetCleave epitopes with the
+        # HLA alleles. The product is kept as codes and expanded chunk by chunk.
+        output_netcleave = results["NetCleave"]
+        recordRowsIn(len(output_netcleave))
+
+        list_alleles = [value.strip() for value in alleles.split("\n")]
+        return PairProduct(output_netcleave, list_alleles)
+
+    def survivors(results: dict) -> pd.DataFrame:
+        # Pairs of the chunk passing the cascade pre-filter on their MHCflurry
+        # scores
+        output_flurry = results["MHCflurry"]
+        passed = output_flurry[prefilterMask(output_flurry, params)]
+        return (
+            passed[["epitope", "hla_allele"]].drop_duplicates().reset_index(drop=True)
+        )
+
+    def stage_peptides(results: dict) -> pd.DataFrame:
+        # PCH and TAP only depend on the peptide, score each epitope once
+        if prefilter:
+            source = survivors(results)
+        else:
+            source = results["NetCleave"] if simulation == 1 else df
+        source = cast(pd.DataFrame, source)
+        peptides = source[["epitope"]].drop_duplicates()
+        if prefilter:
+            # The survivors of the previous chunks are already scored
+            scored = peptides["epitope"].isin(results["scored_epitopes"])
+            peptides = peptides[~scored]
+        return peptides.reset_index(drop=True)
+
+    def stage_pairs(results: dict, survivors_only: bool = False) -> pd.DataFrame:
+        # MHCflurry and NOAH depend on the (epitope, allele) pair, they score
+        # the unique pairs of the current chunk
+        if survivors_only:
+            pairs = survivors(results).rename(columns={"hla_allele": "HLA_allele"})
+        else:
+            pairs = results["pairs"]
+        recordRowsIn(len(pairs))
+        return pairs
+
+    def pch_stage(results: dict) -> pd.DataFrame:
+        # Run the PCH ["epitope"]
+        print("Running PCH")
+        peptides = stage_peptides(results)
+        recordRowsIn(len(peptides))
+        return runCached(
+            score_cache,
+            "PCH",
+            toolVersion(pchPath),
+            {"seed": int(seed)},
+            peptides,
+            ["epitope"],
+            lambda df_csv: runPredigPCH(
+                df_csv=df_csv,
+                seed=int(seed),
+                predigPCH_path=pchPath,
+            ),
+            output_key_columns=["epitope"],
+            output_columns=PCH_COLUMNS,
+        )
+
+    def mhcflurry_stage(results: dict) -> pd.DataFrame:
+        print("Running MHCflurry")
+        # Run the MHCflurry ["epitope", "hla_allele"]
+        if params["mhcflurry_engine"] == "in-process":
+            version = engineVersion()
+            run = predictMHCflurry
+        else:
+            version = toolVersion(mhcflurryPath)
+            run = lambda df_csv: runPredigMHCflurry(
+                df_csv=df_csv,
+                predigMHCflurry_path=mhcflurryPath,
+                tool_io=params["tool_io"],
+            )
+
+        return runCached(
+            score_cache,
+            "MHCflurry",
+            version,
+            {},
+            stage_pairs(results),
+            ["epitope", "HLA_allele"],
+            run,
+            output_key_columns=["epitope", "hla_allele"],
+            output_columns=MHCFLURRY_COLUMNS,
+        )
+
+    def noah_stage(results: dict) -> pd.DataFrame:
+        print("Running NOAH")
+        # Run the NOAH, ["HLA", "epitope", "NOAH_score"] id="HLA", "epitope"
+        return runCached(
+            score_cache,
+            "NOAH",
+            toolVersion(noahPath),
+            {"model": toolVersion(model)},
+            stage_pairs(results, survivors_only=prefilter),
+            ["epitope", "HLA_allele"],
+            lambda df_csv: runPredigNOAH(
+                df_csv=df_csv,
+                predigNOAH_path=noahPath,
+                model=model,
+                python_exec=python_exec,
+            ),
+            output_key_columns=["epitope", "hla_allele"],
+            output_columns=NOAH_COLUMNS,
+        )
+
+    def tapmap_stage(results: dict) -> pd.DataFrame:
+        print("Running tapmat_pred_fsa")
+        peptides = stage_peptides(results)
+        recordRowsIn(len(peptides))
+        return runCached(
+            score_cache,
+            "TAP",
+            toolVersion(tapmat_pred_fsa_path),
+            {
+                "mat": toolVersion(mat),
+                "peptide_len": peptide_len,
+                "alpha": alpha,
+                "precursor_len": precursor_len,
+            },
+            peptides,
+            ["epitope"],
+            lambda df_csv: run_Predig_tapmap(
+                df_csv=df_csv,
+                tapmap_path=tapmat_pred_fsa_path,
+                mat=mat,
+                peptide_len=peptide_len,
+                alpha=alpha,
+                precursor_len=precursor_len,
+                workers=tapmap_workers,
+                tool_io=params["tool_io"],
+            ),
+            output_key_columns=["epitope"],
+            output_columns=TAP_COLUMNS,
+        )
+
+    # NetCleave, the fasta expansion and, without the cascade pre-filter,
+    # PCH and TAP run once for the whole input and stay resident. MHCflurry
+    # and NOAH run on the pairs of one chunk of rows at a time, the chunk is
+    # joined, scored and yielded before the next one starts.
+    resident_stages = [Stage("NetCleave", netcleave_stage)]
+    if simulation == 1:
+        resident_stages.append(Stage("input", expand_stage, ["NetCleave"]))
+    if not prefilter:
+        # Only the fasta mode needs the NetCleave epitopes first
+        peptide_dependencies = ["NetCleave"] if simulation == 1 else []
+        resident_stages += [
+            Stage("PCH", pch_stage, peptide_dependencies),
+            Stage("TAP", tapmap_stage, peptide_dependencies),
+        ]
+
+    # The fasta chunks are rows of the expansion, their checkpoints are keyed
+    # by its checkpoint (NetCleave and the alleles). The CSV rows are covered
+    # by the input digest.
+    chunk_dependencies = ["input"] if simulation == 1 else []
+
+    # With the cascade pre-filter, the other tools wait for the MHCflurry
+    # scores of the chunk. PCH and TAP score the surviving epitopes not seen
+    # in the previous chunks and their outputs are kept for the later ones.
+    chunk_stages = [Stage("MHCflurry", mhcflurry_stage, chunk_dependencies)]
+    if prefilter:
+        chunk_stages += [
+            Stage("PCH", pch_stage, ["MHCflurry"]),
+            Stage("NOAH", noah_stage, ["MHCflurry"]),
+            Stage("TAP", tapmap_stage, ["MHCflurry"]),
+        ]
+    else:
+        chunk_stages.append(Stage("NOAH", noah_stage, chunk_dependencies))
+
+    checkpoints = None
+    stage_params: typing.Dict[str, dict] = {}
+    digest = ""
+    # Checkpoint keys of the resident stages, the chunk keys are chained to them
+    resident_keys: typing.Dict[str, str] = {}
+    if params["checkpoint_dir"]:
+        checkpoints = CheckpointStore(params["checkpoint_dir"])
+        stage_params = stageParams(params)
+        digest = inputDigest(df=df, fasta=fasta)
+
+    def prepare(stages: typing.List[Stage], chunk: typing.Optional[int] = None):
+        # Stages whose output was saved by a previous attempt are restored,
+        # the stages of a chunk are keyed by its position
+        if checkpoints is not None:
+            keyed = stage_params
+            keys = resident_keys
+            if chunk is not None:
+                keyed = {
+                    name: dict(values, chunk=chunk, chunk_size=chunk_size)
+                    for name, values in stage_params.items()
+                }
+                keys = dict(resident_keys)
+            stages = checkpointStages(stages, checkpoints, keyed, digest, keys)
+
+        return [
+            Stage(
+                stage.name,
+                metrics.instrument(stage.name, stage.action),
+                stage.dependencies,
+            )
+            for stage in stages
+        ]
+
+    resident_stages = prepare(resident_stages)
+    # The fasta chunks are expanded from the NetCleave epitopes, the other
+    # resident stages run in the background while the first chunks are scored
+    if simulation == 1:
+        first = [s for s in resident_stages if s.name in ("NetCleave", "input")]
+    else:
+        first = []
+    background_stages = [s for s in resident_stages if s not in first]
+
+    resident = runStages(
+        first, max_workers=params["stage_workers"], scratch_root=scratch_root
+    )
+
+    with metrics.stage("Join"):
+        # The tools score unique epitopes or pairs, their outputs are broadcast
+        # back to every input row through the integer codes of the epitope
+        # and allele
+        if simulation == 1:
+            product = cast(PairProduct, resident["input"])
+            keys = product.keys()
+            # NetCleave depends on the protein of each row, its output is per
+            # row and kept by the product
+            chunks = product.chunks(chunk_size)
+        else:
+            rows = cast(pd.DataFrame, df).reset_index(drop=True)
+            keys = KeyCodes(rows["epitope"], rows["HLA_allele"])
+            chunks = csvChunks(rows, keys, chunk_size)
+
+    # Keep the features of the run, so it can be rescored without the tools
+    feature_writer = (
+        FeatureWriter(features_file)
+        if features_file is not None
+        else contextlib.nullcontext()
+    )
+
+    # Epitopes scored by PCH and TAP in the previous chunks (pre-filter)
+    scored_epitopes: typing.Set[str] = set()
+    peptide_outputs: typing.Dict[str, typing.Optional[pd.DataFrame]] = {
+        "PCH": None,
+        "TAP": None,
+    }
+    passed_pairs = 0
+    filtered_pairs = 0
+    join: typing.Optional[KeyedJoin] = None
+    position = 0
+
+    # The background resident stages and the chunk stages run together, they
+    # share one pool so at most stage_workers stages run at the same time
+    stage_pool = ThreadPoolExecutor(max_workers=max(1, int(params["stage_workers"])))
+    background = ThreadPoolExecutor(max_workers=1)
+
+    # The spilled features are discarded when the run fails or is abandoned
+    with feature_writer as features, stage_pool, background:
+        pending = background.submit(
+            runStages,
+            background_stages,
+            scratch_root=scratch_root,
+            finished=resident,
+            executor=stage_pool,
+        )
+
+        for index, (df_base, epitope_codes, allele_codes) in enumerate(chunks):
+            pairs = (
+                df_base[["epitope", "hla_allele"]]
+                .drop_duplicates()
+                .rename(columns={"hla_allele": "HLA_allele"})
+                .reset_index(drop=True)
+            )
+            results = runStages(
+                prepare(chunk_stages, chunk=index),
+                scratch_root=scratch_root,
+                finished=dict(
+                    resident, pairs=pairs, scored_epitopes=scored_epitopes
+                ),
+                executor=stage_pool,
+            )
+
+            if pending is not None:
+                resident.update(pending.result())
+                pending = None
+                if not prefilter:
+                    peptide_outputs = {
+                        "PCH": resident["PCH"],
+                        "TAP": resident["TAP"],
+                    }
+
+            if prefilter:
+                passed = prefilterMask(results["MHCflurry"], params)
+                passed_pairs += int(passed.sum())
+                filtered_pairs += len(passed)
+                scored_epitopes.update(survivors(results)["epitope"])
+                for name in ("PCH", "TAP"):
+                    peptide_outputs[name] = appendOutput(
+                        peptide_outputs[name], results[name]
+                    )
+
+            if simulation != 1:
+                netcleave = resident["NetCleave"]["netcleave"].values
+                df_base["netcleave"] = netcleave[position : position + len(df_base)]
+                position += len(df_base)
+
+            outputs = {
+                0: (peptide_outputs["PCH"], ["epitope"], "_pch"),
+                1: (results["MHCflurry"], ["epitope", "hla_allele"], "_mhcflurry"),
+                2: (peptide_outputs["TAP"], ["epitope"], "_tapmap"),
+                3: (results["NOAH"], ["epitope", "hla_allele"], "_noah"),
+            }
+
+            with metrics.stage("Join") as join_metrics:
+                join_metrics.rows_in = (join_metrics.rows_in or 0) + len(df_base)
+                if join is None:
+                    join = KeyedJoin(keys, [outputs[i] for i in sorted(outputs)])
+                else:
+                    # The resident peptide outputs are prepared only once
+                    if not prefilter:
+                        del outputs[0], outputs[2]
+                    join = join.withOutputs(outputs)
+
+                df_joined = join.join(df_base, epitope_codes, allele_codes)
+                # The pruned rows are flagged and only keep their NetCleave and
+                # MHCflurry scores, the model does not score them
+                if prefilter:
+                    pruned = ~prefilterMask(df_joined, params)
+                    cascade_columns = [
+                        column
+                        for column in df_joined.columns
+                        if column not in df_base.columns
+                        and column not in results["MHCflurry"].columns
+                    ]
+                    df_joined.loc[pruned, cascade_columns] = np.nan
+                    df_joined["pruned"] = pruned
+                join_metrics.rows_out = (join_metrics.rows_out or 0) + len(df_joined)
+
+            # Only the resident outputs outlive the chunk
+            del results, outputs
+
+            if features is not None:
+                features.append(df_joined)
+
+            with metrics.stage("XGBoost") as score_metrics:
+                score_metrics.rows_in = (score_metrics.rows_in or 0) + len(df_joined)
+                df_joined = scorePredIG(df_joined, params)
+                score_metrics.rows_out = (score_metrics.rows_out or 0) + len(df_joined)
+
+            yield df_joined
+
+    if score_cache is not None:
+        score_cache.report()
+
+    if prefilter:
+        print(
+            f"Cascade pre-filter ({params['prefilter']}): "
+            f"{passed_pairs} of {filtered_pairs} pairs passed"
+        )
+        if passed_pairs == 0:
+            print("No pair passed, PCH, NOAH and TAP were skipped")
+
+
+def csvChunks(
+    df: pd.DataFrame, keys: KeyCodes, chunk_size: int
+) -> typing.Iterator[typing.Tuple[pd.DataFrame, np.ndarray, np.ndarray]]:
+    """
+    The (epitope, hla_allele) rows of the input CSV with their codes, at
+    most chunk_size rows at a time. At least one (maybe empty) chunk is
+    produced.
+    """
+
+    for start in range(0, max(len(df), 1), chunk_size):
+        stop = start + chunk_size
+        base = (
+            df.iloc[start:stop][["epitope", "HLA_allele"]]
+            .rename(columns={"HLA_allele": "hla_allele"})
+            .reset_index(drop=True)
+        )
+        yield base, keys.epitope_codes[start:stop], keys.allele_codes[start:stop]
+
+
+def appendOutput(
+    resident: typing.Optional[pd.DataFrame], output: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Rows of a peptide level tool output added to the ones of the previous
+    chunks, the empty outputs only keep their columns
+    """
+
+    if resident is None or len(resident) == 0:
+        return output
+    if len(output) == 0:
+        return resident
+    return pd.concat([resident, output], ignore_index=True)
+
+
+def prefilterMask(df: pd.DataFrame, params: dict) -> pd.Series:
+    """
+    Rows of a frame with the MHCflurry columns passing the cascade
+    pre-filter. Rows without MHCflurry scores do not pass.
+    """
+
+    if params["prefilter"] == "affinity percentile":
+        percentile = pd.to_numeric(df["mhcflurry_affinity_percentile"])
+        return percentile <= float(params["prefilter_max_percentile"])
+    if params["prefilter"] == "presentation score":
+        presentation = pd.to_numeric(df["mhcflurry_presentation_score"])
+        return presentation >= float(params["prefilter_min_presentation"])
+    if params["prefilter"] == "off":
+        return pd.Series(True, index=df.index)
+
+    raise ValueError(f"Unknown pre-filter {params['prefilter']}")
+
+
+def scorePredIG(df_joined: pd.DataFrame, params: dict) -> pd.DataFrame:
+    """
+    Score the joined tool outputs with the PredIG model(s) and format the
+    results table. Rows flagged in the pruned column (cascade pre-filter)
+    are not scored.
+    """
+
+    modelXG = params["modelXG"]
+
+    print("Launching the XGBoost model")
+
+    # Only the rows that went through every tool are scored
+    scored = pd.Series(True, index=df_joined.index)
+    if "pruned" in df_joined.columns:
+        df_joined["pruned"] = df_joined["pruned"].astype(bool)
+        scored = ~df_joined["pruned"]
+
+    # The feature matrix is built once and shared by every selected model
+    features = featureMatrix(df_joined[scored])
+
+    def predict(path: str) -> np.ndarray:
+        if scored.all():
+            return predictScores(path, features, nthread=params["xgboost_threads"])
+        scores = np.full(len(df_joined), np.nan, dtype=np.float32)
+        if scored.any():
+            scores[scored.to_numpy()] = predictScores(
+                path, features, nthread=params["xgboost_threads"]
+            )
+        return scores
+
+    df_joined["predig"] = predict(modelXG)
+
+    # Multi-model mode: one extra PredIG column per selected model
+    model_columns = {}
+    for name, path in params["modelsXG"].items():
+        if path == modelXG:
+            df_joined[name] = df_joined["predig"]
+        else:
+            print(f"Scoring with {name}")
+            df_joined[name] = predict(path)
+        model_columns[name.lower()] = name
+
+    # Optional classification of the PredIG score
+    threshold = params.get("threshold")
+    if threshold is not None:
+        df_joined["immunogenic"] = df_joined["predig"] >= float(threshold)
+        model_columns["immunogenic"] = "Immunogenic"
+
+    if "pruned" in df_joined.columns:
+        model_columns["pruned"] = "Pruned"
+
+    df_joined["id"] = df_joined["hla_allele"] + "_" + df_joined["epitope"]
+
+    # Rename and sort the columns
+    name_mapping = {
+        "Id": "ID",
+        "Epitope": "epitope",
+        "Hla_allele": "HLA_allele",
+        "Predig": "PredIG",
+        "NOAH": "NOAH",
+        "TAP": "TAP",
+        "Netcleave": "NetCleave",
+        "Mhcflurry_affinity": "mhcflurry_affinity",
+        "Mhcflurry_affinity_percentile": "mhcflurry_affinity_percentile",
+        "Mhcflurry_presentation_score": "mhcflurry_presentation_score",
+        "Mhcflurry_processing_score": "mhcflurry_processing_score",
+        "Hydroph_peptide": "Hydrophobicity_peptide",
+        "Mw_peptide": "MW_peptide",
+        "Charge_peptide": "Charge_peptide",
+        "Stab_peptide": "Stab_peptide",
+        "Tcr_contact": "TCR_contact",
+        "Hydroph_tcr_contact": "Hydrophobicity_tcr_contact",
+        "Mw_tcr_contact": "MW_tcr_contact",
+        "Charge_tcr_contact": "Charge_tcr_contact",
+    }
+
+    name_mapping = {key.lower(): value for key, value in name_mapping.items()}
+
+    # Place the per-model scores (and the class) right after the PredIG score
+    position = list(name_mapping).index("predig") + 1
+    items = list(name_mapping.items())
+    name_mapping = dict(
+        items[:position] + list(model_columns.items()) + items[position:]
+    )
+
+    df_joined = df_joined.rename(str.lower, axis="columns")
+
+    # Sort based on the mapping
+    df_joined = df_joined[name_mapping.keys()]
+
+    # Rename
+    df_joined = df_joined.rename(columns=name_mapping)
+
+    # Remove unwanted columns
+    columns_to_delete = [c.lower() for c in params["columns_to_delete"]]
+
+    for col in df_joined.columns:
+        if col.lower() in columns_to_delete:
+            df_joined = df_joined.drop(columns=col)
+
+    return df_joined
+
+
+def rescorePredIG(params: dict, features_file: str) -> pd.DataFrame:
+    """
+    Score the saved features of a previous run with the model(s) and
+    threshold of params, without running any of the tools
+    """
+
+    print(f"Loading the features of {features_file}")
+    df_joined = loadFeatures(features_file)
+
+    return scorePredIG(df_joined, params)
+
+
+def splitFasta(fasta: str) -> typing.List[str]:
+    """
+    Split a multi-fasta file into its records (header and sequence lines)
+    """
+
+    records: typing.List[str] = []
+    with open(fasta, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith(">") or not records:
+                records.append("")
+            records[-1] += line if line.endswith("\n") else line + "\n"
+
+    return [record for record in records if record.strip() != ""]
+
+
+def balancedShards(
+    records: typing.List[str], shards: int
+) -> typing.List[typing.List[str]]:
+    """
+    Split the fasta records into at most shards contiguous groups holding
+    about the same number of residues
+    """
+
+    lengths = [
+        sum(len(line.strip()) for line in record.splitlines()[1:])
+        for record in records
+    ]
+    # Without any residue, balance the number of records instead
+    if sum(lengths) == 0:
+        lengths = [1] * len(records)
+    total = sum(lengths)
+    shards = max(1, min(int(shards), len(records)))
+
+    groups: typing.List[typing.List[str]] = [[]]
+    done = 0
+    for record, length in zip(records, lengths):
+        # Close the group once it reaches its share of the residues
+        if (
+            groups[-1]
+            and len(groups) < shards
+            and done >= total * len(groups) / shards
+        ):
+            groups.append([])
+        groups[-1].append(record)
+        done += length
+
+    return groups
+
+
+def runNetCleaveFasta(fasta: str, params: dict) -> pd.DataFrame:
+    """
+    Run NetCleave on a multi-fasta, split by record into shards balanced by
+    sequence length that run in parallel. The shard outputs are
+    concatenated in the order of the fasta.
+    """
+
+    shards = balancedShards(splitFasta(fasta), params["netcleave_workers"])
+    if len(shards) > 1:
+        print(f"Running NetCleave on {len(shards)} fasta shards")
+
+    def runShard(records: typing.List[str]) -> pd.DataFrame:
+        with scratchDir("netcleave", params["scratch_dir"]) as workdir:
+            # NetCleave names its output after the input file (input.fasta)
+            shard_fasta = os.path.join(workdir, "input.fasta")
+            with open(shard_fasta, "w", encoding="utf-8") as f:
+                f.writelines(records)
+
+            return runPredigNetCleave(
+                predigNetcleave_path=params["netcleave_path"],
+                mode=1,
+                fasta=shard_fasta,
+                python_exec=params["python_exec"],
+                workdir=workdir,
+            )
+
+    # The shards run in a copy of the context, to keep the stage metrics
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, runShard, records)
+            for records in shards
+        ]
+        outputs = [future.result() for future in futures]
+
+    return pd.concat(outputs, ignore_index=True)
+
+
+def countQueries(
+    df: typing.Optional[pd.DataFrame] = None, fasta: typing.Optional[str] = None
+) -> int:
+    """
+    Number of queries of a submission: rows of the CSV or records of the fasta
+    """
+
+    if df is not None:
+        return len(df)
+    if fasta is not None:
+        return len(splitFasta(fasta))
+    return 0
+
+
+def _runShard(shard_dir: str, params: dict) -> typing.Tuple[str, int, str, dict]:
+    """
+    Run the whole pipeline for a shard inside its own folder. Executed in a
+    worker process, the logs and metrics are returned to the parent.
+    """
+
+    metrics = RunMetrics()
+    logs = io.StringIO()
+    with contextlib.redirect_stdout(logs), contextlib.redirect_stderr(logs):
+        os.chdir(shard_dir)
+        if params["simulation"] == 1:
+            df, fasta = readInput(1, "input.fasta")
+        else:
+            df, fasta = readInput(params["simulation"], "input.csv")
+
+        rows = writePredIG(
+            params,
+            "shard_output.csv",
+            df=df,
+            fasta=fasta,
+            features_file="shard_features.npz",
+            metrics=metrics,
+        )
+
+    shard_output = os.path.join(shard_dir, "shard_output.csv")
+    return shard_output, rows, logs.getvalue(), metrics.toDict()
+
+
+def runPredIGBatch(
+    params: dict,
+    output_file: str,
+    df: typing.Optional[pd.DataFrame] = None,
+    fasta: typing.Optional[str] = None,
+    shard_size: int = 500,
+    max_workers: int = 2,
+    features_file: typing.Optional[str] = None,
+    metrics: typing.Optional[RunMetrics] = None,
+) -> int:
+    """
+    Split the input into shards of shard_size queries, run the pipeline on
+    at most max_workers shards at the same time and append the shard outputs,
+    in order, to output_file. The shard features are gathered in
+    features_file and the shard measurements added to metrics, when given.
+    Returns the number of rows written.
+    """
+
+    shard_size = max(1, int(shard_size))
+    batch_dir = os.path.abspath("predig_batch")
+    if os.path.exists(batch_dir):
+        shutil.rmtree(batch_dir)
+    os.makedirs(batch_dir)
+
+    # Write the shard inputs, only one shard is kept in memory at a time
+    shard_dirs: typing.List[str] = []
+    if df is not None:
+        for start in range(0, len(df), shard_size):
+            shard_dir = os.path.join(batch_dir, f"shard_{len(shard_dirs):05d}")
+            os.makedirs(shard_dir)
+            df.iloc[start : start + shard_size].to_csv(
+                os.path.join(shard_dir, "input.csv"), index=False
+            )
+            shard_dirs.append(shard_dir)
+    elif fasta is not None:
+        records = splitFasta(fasta)
+        for start in range(0, len(records), shard_size):
+            shard_dir = os.path.join(batch_dir, f"shard_{len(shard_dirs):05d}")
+            os.makedirs(shard_dir)
+            with open(
+                os.path.join(shard_dir, "input.fasta"), "w", encoding="utf-8"
+            ) as f:
+                f.writelines(records[start : start + shard_size])
+            shard_dirs.append(shard_dir)
+    else:
+        raise ValueError("Either df or fasta must be provided.")
+
+    print(
+        f"Batch mode: {len(shard_dirs)} shards of up to {shard_size} queries, {max_workers} at a time"
+    )
+
+    rows = 0
+    feature_writer = (
+        FeatureWriter(features_file)
+        if features_file is not None
+        else contextlib.nullcontext()
+    )
+    with feature_writer as features:
+        # The shards chdir into their folder, so they must run in their own
+        # process. The workers are spawned, not forked: this process may hold
+        # TensorFlow (in-process MHCflurry) threads and locks that a fork would
+        # copy.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=max(1, int(max_workers)), mp_context=context
+        ) as executor:
+            futures = [
+                executor.submit(_runShard, shard_dir, params)
+                for shard_dir in shard_dirs
+            ]
+
+            with open(output_file, "w", encoding="utf-8") as output:
+                for i, future in enumerate(futures):
+                    shard_output, shard_rows, logs, shard_metrics = future.result()
+                    print(
+                        f"============== Shard {i + 1}/{len(futures)} =============="
+                    )
+                    print(logs)
+
+                    # Stream the shard output, keeping only the first header
+                    with open(shard_output, "r", encoding="utf-8") as f:
+                        header = f.readline()
+                        if i == 0:
+                            output.write(header)
+                        shutil.copyfileobj(f, output)
+
+                    if metrics is not None:
+                        metrics.merge(shard_metrics)
+
+                    if features is not None:
+                        features.append(
+                            loadFeatures(
+                                os.path.join(shard_dirs[i], "shard_features.npz")
+                            )
+                        )
+
+                    rows += shard_rows
+                    shutil.rmtree(shard_dirs[i])
+
+        shutil.rmtree(batch_dir)
+
+    return rows
@@ -0,0 +1,159 @@
+"""
+Dependency-aware stage scheduler used by the PredIG pipeline.
+
+Stages form a DAG: a stage is submitted to the worker pool as soon as all
+of its dependencies have finished, so independent tools run concurrently.
+Every stage runs inside its own scratch directory, so stages running at the
+same time never share the files of their tools.
+"""
+
+import contextlib
+import typing
+
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+
+from scratch import stageScratchDir
+
+
+class Stage:
+    """
+    A single step of the pipeline.
+
+    The action receives a dictionary with the results of the finished stages
+    (keyed by stage name) and returns the result of this stage.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        action: typing.Callable[[typing.Dict[str, typing.Any]], typing.Any],
+        dependencies: typing.Optional[typing.List[str]] = None,
+    ):
+        self.name = name
+        self.action = action
+        self.dependencies = list(dependencies or [])
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, dependencies={self.dependencies!r})"
+
+
+def verifyStages(stages: typing.List[Stage], finished: typing.Iterable[str] = ()):
+    """
+    Check that the stage names are unique, that every dependency exists (or
+    is in finished) and that the graph has no cycles.
+    """
+
+    names = [stage.name for stage in stages]
+    duplicated = {name for name in names if names.count(name) > 1}
+    if duplicated:
+        raise ValueError(f"Duplicated stage names: {sorted(duplicated)}")
+
+    known = set(names) | set(finished)
+    for stage in stages:
+        unknown = [d for d in stage.dependencies if d not in known]
+        if unknown:
+            raise ValueError(
+                f"Stage '{stage.name}' depends on unknown stages: {unknown}"
+            )
+
+    # Kahn's algorithm, only to detect cycles
+    pending = {stage.name: set(stage.dependencies) & set(names) for stage in stages}
+    while pending:
+        ready = [name for name, deps in pending.items() if not deps]
+        if not ready:
+            raise ValueError(
+                f"The stages contain a dependency cycle: {sorted(pending)}"
+            )
+        for name in ready:
+            del pending[name]
+        for deps in pending.values():
+            deps.difference_update(ready)
+
+
+def _runIsolated(
+    stage: Stage, results: typing.Dict[str, typing.Any], scratch_root: str
+) -> typing.Any:
+    # The tool wrappers called by the action default to this directory
+    with stageScratchDir(stage.name.lower().replace(" ", "_"), scratch_root):
+        return stage.action(results)
+
+
+def runStages(
+    stages: typing.List[Stage],
+    max_workers: int = 1,
+    scratch_root: typing.Optional[str] = None,
+    finished: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    executor: typing.Optional[Executor] = None,
+) -> typing.Dict[str, typing.Any]:
+    """
+    Run the stages respecting their dependencies using a pool of at most
+    max_workers threads. Returns the results of every stage keyed by name.
+
+    finished holds the results of stages that already ran (e.g. in a
+    previous call), the stages can depend on them and see them in their
+    results.
+
+    executor is a pool shared by calls running at the same time, so they
+    run at most its number of stages together. max_workers is ignored when
+    it is given.
+
+    Each stage runs in a private scratch directory under scratch_root (the
+    system temporary folder when empty), removed when the stage ends.
+
+    If a stage fails, no new stages are started, the running ones are
+    awaited and the first error is raised.
+    """
+
+    finished = finished or {}
+    verifyStages(stages, finished)
+
+    max_workers = max(1, int(max_workers))
+    results: typing.Dict[str, typing.Any] = dict(finished)
+    remaining = {stage.name: stage for stage in stages}
+    running: typing.Dict[Future, Stage] = {}
+    error: typing.Optional[BaseException] = None
+
+    pool = (
+        contextlib.nullcontext(executor)
+        if executor is not None
+        else ThreadPoolExecutor(max_workers=max_workers)
+    )
+    with pool as stage_pool:
+        while remaining or running:
+            if error is None:
+                ready = [
+                    stage
+                    for stage in remaining.values()
+                    if all(d in results for d in stage.dependencies)
+                ]
+                for stage in ready:
+                    del remaining[stage.name]
+                    # Each stage only sees a snapshot of the finished results
+                    future = stage_pool.submit(
+                        _runIsolated, stage, dict(results), scratch_root or ""
+                    )
+                    running[future] = stage
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                except BaseException as e:
+                    print(f"Stage '{stage.name}' failed: {e}")
+                    if error is None:
+                        error = e
+
+    if error is not None:
+        raise error
+
+    return {name: result for name, result in results.items() if name not in finished}
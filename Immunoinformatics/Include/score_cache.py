@@ -0,0 +1,297 @@
+"""
+Persistent cross-run cache of the scores produced by the PredIG tools.
+
+Every cached row is content-addressed by the hash of the tool name, the tool
+version, the parameters of the run and the key values of the row (usually
+the epitope and the HLA allele). The cache lives in a SQLite database and is
+bounded in size by evicting the least recently used rows. The number of
+rows is kept up to date by triggers, so checking the bound is constant time.
+"""
+
+import contextlib
+import hashlib
+import json
+import math
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import typing
+
+import pandas as pd
+
+
+def toolVersion(path: str) -> str:
+    """
+    Fingerprint of an executable or script: its real path, size and
+    modification time. Any update of the tool invalidates its cached scores.
+    """
+
+    if not path:
+        return ""
+
+    resolved = path if os.path.isfile(path) else shutil.which(path)
+    if resolved is None:
+        return path
+
+    stat = os.stat(resolved)
+    return f"{os.path.realpath(resolved)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def cacheKey(
+    tool: str, version: str, params: dict, values: typing.Sequence[typing.Any]
+) -> str:
+    """
+    Content address of a single row of a tool output
+    """
+
+    payload = json.dumps(
+        [tool, version, params, [str(v) for v in values]],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ScoreCache:
+    """
+    SQLite backed score cache shared between runs and processes
+    """
+
+    def __init__(self, path: str, max_entries: int = 5_000_000):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_entries = int(max_entries)
+        self.stats: typing.Dict[str, typing.Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Several processes may open the cache at once
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "key TEXT PRIMARY KEY, tool TEXT, value TEXT, last_used REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS scores_count ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER)"
+            )
+            # Counted once, when the database was created without the counter
+            if connection.execute("SELECT 1 FROM scores_count").fetchone() is None:
+                connection.execute(
+                    "INSERT INTO scores_count (id, entries) "
+                    "SELECT 0, COUNT(*) FROM scores"
+                )
+            connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS scores_insert AFTER INSERT ON scores "
+                "BEGIN UPDATE scores_count SET entries = entries + 1; END"
+            )
+            connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS scores_delete AFTER DELETE ON scores "
+                "BEGIN UPDATE scores_count SET entries = entries - 1; END"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> typing.Iterator[sqlite3.Connection]:
+        """
+        Connection committed when the block succeeds, and always closed
+        """
+
+        with contextlib.closing(
+            sqlite3.connect(self.path, timeout=60)
+        ) as connection, connection:
+            yield connection
+
+    def get(self, keys: typing.List[str]) -> typing.Dict[str, dict]:
+        """
+        Return the cached rows found for the given keys
+        """
+
+        found: typing.Dict[str, dict] = {}
+        if not keys:
+            return found
+
+        with self._lock, self._connect() as connection:
+            # Stay below the SQLite limit of host parameters per query
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    f"SELECT key, value FROM scores WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                for key, value in rows:
+                    found[key] = json.loads(value)
+
+            now = time.time()
+            connection.executemany(
+                "UPDATE scores SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+
+        return found
+
+    def put(self, tool: str, rows: typing.Dict[str, dict]):
+        """
+        Store the rows and evict the least recently used ones if the cache
+        grew over its size bound
+        """
+
+        if not rows:
+            return
+
+        now = time.time()
+        with self._lock, self._connect() as connection:
+            # An upsert, unlike INSERT OR REPLACE, fires the insert trigger
+            # only for new keys
+            connection.executemany(
+                "INSERT INTO scores (key, tool, value, last_used) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                "tool = excluded.tool, value = excluded.value, "
+                "last_used = excluded.last_used",
+                [
+                    (key, tool, json.dumps(row, default=str), now)
+                    for key, row in rows.items()
+                ],
+            )
+
+            (count,) = connection.execute(
+                "SELECT entries FROM scores_count"
+            ).fetchone()
+            if count > self.max_entries:
+                evicted = count - self.max_entries
+                connection.execute(
+                    "DELETE FROM scores WHERE key IN ("
+                    "SELECT key FROM scores ORDER BY last_used LIMIT ?)",
+                    (evicted,),
+                )
+                print(f"Score cache: evicted {evicted} entries")
+
+    def record(self, tool: str, hits: int, misses: int):
+        with self._lock:
+            stats = self.stats.setdefault(tool, {"hits": 0, "misses": 0})
+            stats["hits"] += hits
+            stats["misses"] += misses
+
+    def report(self):
+        """
+        Print the hit/miss report of this run
+        """
+
+        print("============== Score cache report ==============")
+        for tool, stats in self.stats.items():
+            total = stats["hits"] + stats["misses"]
+            ratio = 100 * stats["hits"] / total if total else 0
+            print(
+                f"{tool}: {stats['hits']} hits, {stats['misses']} misses ({ratio:.1f}% hit rate)"
+            )
+        print("============== Score cache report ==============")
+
+
+def _hasMissingValues(row: dict, key_columns: typing.List[str]) -> bool:
+    for column, value in row.items():
+        if column in key_columns:
+            continue
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return True
+    return False
+
+
+def runCached(
+    cache: typing.Optional[ScoreCache],
+    tool: str,
+    version: str,
+    params: dict,
+    df: pd.DataFrame,
+    key_columns: typing.List[str],
+    run: typing.Callable[[pd.DataFrame], pd.DataFrame],
+    output_key_columns: typing.Optional[typing.List[str]] = None,
+    output_columns: typing.Optional[typing.List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Run a tool only for the rows of df missing from the cache.
+
+    The tool is called with the unique uncached rows. Its output is matched
+    back to the input either through output_key_columns (the names of the
+    key columns in the tool output) or, when those are not given, by
+    position. The returned DataFrame has one row per input row, in order.
+
+    The tool is never called with an empty df, the result then only has the
+    key columns and output_columns (the other columns of the tool output).
+    """
+
+    if len(df) == 0:
+        return pd.DataFrame(
+            columns=(output_key_columns or key_columns) + (output_columns or [])
+        )
+
+    if cache is None:
+        return run(df)
+
+    df = df.reset_index(drop=True)
+    row_keys = [
+        cacheKey(tool, version, params, values)
+        for values in df[key_columns].itertuples(index=False, name=None)
+    ]
+
+    unique_keys = list(dict.fromkeys(row_keys))
+    cached = cache.get(unique_keys)
+
+    missing = [key not in cached for key in row_keys]
+    df_missing = df[missing]
+    df_missing = df_missing[
+        ~pd.Series(row_keys, index=df.index)[missing].duplicated()
+    ]
+
+    cache.record(tool, len(unique_keys) - len(df_missing), len(df_missing))
+
+    if len(df_missing) > 0:
+        output = run(df_missing.reset_index(drop=True))
+        records = output.to_dict(orient="records")
+
+        if output_key_columns is None:
+            if len(records) != len(df_missing):
+                raise ValueError(
+                    f"The {tool} output has {len(records)} rows but {len(df_missing)} were expected."
+                )
+            missing_keys = [
+                cacheKey(tool, version, params, values)
+                for values in df_missing[key_columns].itertuples(
+                    index=False, name=None
+                )
+            ]
+        else:
+            missing_keys = [
+                cacheKey(
+                    tool, version, params, [row[c] for c in output_key_columns]
+                )
+                for row in records
+            ]
+
+        computed = dict(zip(missing_keys, records))
+        cache.put(
+            tool,
+            {
+                key: row
+                for key, row in computed.items()
+                if not _hasMissingValues(row, output_key_columns or [])
+            },
+        )
+        cached.update(computed)
+
+    # Rows the tool did not return keep only their keys
+    rows = []
+    for key, values in zip(
+        row_keys, df[key_columns].itertuples(index=False, name=None)
+    ):
+        if key in cached:
+            rows.append(cached[key])
+        else:
+            rows.append(dict(zip(output_key_columns or key_columns, values)))
+
+    return pd.DataFrame.from_records(rows)
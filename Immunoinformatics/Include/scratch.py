@@ -0,0 +1,82 @@
+"""
+Private scratch directories for the tool wrappers.
+
+Every stage writes its tool inputs and outputs in its own directory, so
+stages of the same run, or runs sharing a folder, never overwrite each
+other's files. The directories are created under a configurable root (a
+tmpfs such as /dev/shm keeps the small files off network filesystems) and
+removed with everything inside when the stage ends.
+
+The scheduler runs every stage inside its scratch directory, and the tool
+wrappers default to the directory of the stage running in their context.
+"""
+
+import contextlib
+import contextvars
+import os
+import shutil
+import tempfile
+import typing
+
+_stage_dir: contextvars.ContextVar[typing.Optional[str]] = contextvars.ContextVar(
+    "predig_stage_dir", default=None
+)
+
+
+@contextlib.contextmanager
+def scratchDir(
+    prefix: str, root: typing.Optional[str] = None
+) -> typing.Iterator[str]:
+    """
+    Create a private directory under root (the system temporary folder when
+    empty) and remove it on exit
+    """
+
+    if root:
+        root = os.path.expanduser(root)
+        os.makedirs(root, exist_ok=True)
+    else:
+        root = None
+
+    workdir = tempfile.mkdtemp(prefix=f"predig_{prefix}_", dir=root)
+    try:
+        yield workdir
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def stageScratchDir(
+    prefix: str, root: typing.Optional[str] = None
+) -> typing.Iterator[str]:
+    """
+    scratchDir that is also the working directory of the tool wrappers
+    called in the current context (see currentWorkdir)
+    """
+
+    with scratchDir(prefix, root) as workdir:
+        token = _stage_dir.set(workdir)
+        try:
+            yield workdir
+        finally:
+            _stage_dir.reset(token)
+
+
+def currentWorkdir() -> str:
+    """
+    Scratch directory of the stage running in the current context, the
+    current directory outside of a stage
+    """
+
+    return _stage_dir.get() or "."
+
+
+def resolvePath(path: str) -> str:
+    """
+    Absolute path of an existing file, so it stays valid from a scratch
+    directory. Anything else (e.g. an executable on the PATH) is kept as is.
+    """
+
+    if path and os.path.exists(path):
+        return os.path.abspath(path)
+    return path
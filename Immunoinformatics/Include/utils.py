@@ -1,11 +1,26 @@
+import contextvars
+import io
 import os
 import shutil
 import subprocess
+import threading
 import typing
 import pandas as pd
 
+from concurrent.futures import ThreadPoolExecutor
 
-def runPredigPCH(df_csv: pd.DataFrame, seed: int, predigPCH_path: str):
+from metrics import TrackedPopen
+from scratch import currentWorkdir, resolvePath
+
+
+def runPredigPCH(
+    df_csv: pd.DataFrame,
+    seed: int,
+    predigPCH_path: str,
+    workdir: typing.Optional[str] = None,
+):
+
+    workdir = workdir or currentWorkdir()
 
     # Check if 'peptide' and 'allele' columns exist
     if "peptide" not in df_csv.columns and "epitope" not in df_csv.columns:
@@ -17,19 +32,20 @@ def runPredigPCH(df_csv: pd.DataFrame, seed: int, predigPCH_path: str):
         df_csv = df_csv.rename(columns={"epitope": "peptide"})
 
     df_csv = df_csv[["peptide"]]
-    df_csv.to_csv(".input_pch.csv", index=False)
+    df_csv.to_csv(os.path.join(workdir, ".input_pch.csv"), index=False)
 
     # Run the PCH
     try:
-        proc = subprocess.Popen(
+        proc = TrackedPopen(
             [
                 "Rscript",
-                predigPCH_path,
+                resolvePath(predigPCH_path),
                 "--input",
                 ".input_pch.csv",
                 "--seed",
                 str(seed),
             ],
+            cwd=workdir,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
         )
@@ -39,17 +55,24 @@ def runPredigPCH(df_csv: pd.DataFrame, seed: int, predigPCH_path: str):
     except Exception as e:
         raise Exception(f"An error occurred while running the predigPCH: {e}")
 
-    df = pd.read_csv(".input_pch_pch.csv")
+    df = pd.read_csv(os.path.join(workdir, ".input_pch_pch.csv"))
     df = df.rename(columns={"peptide": "epitope"})
-    df.to_csv("output_pch.csv", index=True)
+    df.to_csv(os.path.join(workdir, "output_pch.csv"), index=True)
 
-    os.remove(".input_pch.csv")
-    os.remove(".input_pch_pch.csv")
+    os.remove(os.path.join(workdir, ".input_pch.csv"))
+    os.remove(os.path.join(workdir, ".input_pch_pch.csv"))
 
     return df
 
 
-def runPredigMHCflurry(df_csv: pd.DataFrame, predigMHCflurry_path: str):
+def runPredigMHCflurry(
+    df_csv: pd.DataFrame,
+    predigMHCflurry_path: str,
+    workdir: typing.Optional[str] = None,
+    tool_io: str = "files",
+):
+
+    workdir = workdir or currentWorkdir()
 
     # Check if 'peptide' and 'allele' columns exist
     if "peptide" not in df_csv.columns and "epitope" not in df_csv.columns:
@@ -69,22 +92,53 @@ def runPredigMHCflurry(df_csv: pd.DataFrame, predigMHCflurry_path: str):
         df_csv = df_csv.rename(columns={"epitope": "peptide"})
 
     df_csv = df_csv[["peptide", "allele"]]
-    df_csv.to_csv(".input_MHCflurry.csv", index=False)
+
+    options = ["--no-throw", "--always-include-best-allele", "--no-flanking"]
+
+    if tool_io == "pipes":
+        # The input CSV goes through stdin and the predictions come on stdout
+        lines: typing.List[str] = []
+
+        def collect(line: str):
+            # Skip anything printed before the CSV header
+            if lines or ("peptide" in line and "," in line):
+                lines.append(line)
+
+        try:
+            returncode, stderr = _pipeTool(
+                [resolvePath(predigMHCflurry_path), "/dev/stdin", *options],
+                df_csv.to_csv(index=False),
+                collect,
+                workdir,
+            )
+            print(stderr)
+
+            if returncode != 0:
+                raise RuntimeError(stderr)
+
+        except Exception as e:
+            raise Exception(
+                f"An error occurred while running the PredigMHCflurry: {e}"
+            )
+
+        df = pd.read_csv(io.StringIO("".join(lines)))
+        return df.rename(columns={"allele": "hla_allele", "peptide": "epitope"})
+
+    df_csv.to_csv(os.path.join(workdir, ".input_MHCflurry.csv"), index=False)
 
     output = "output_MHCflurry.csv"
 
     # Run the MHCflurry
     try:
-        proc = subprocess.Popen(
+        proc = TrackedPopen(
             [
-                predigMHCflurry_path,
+                resolvePath(predigMHCflurry_path),
                 ".input_MHCflurry.csv",
                 "--out",
                 output,
-                "--no-throw",
-                "--always-include-best-allele",
-                "--no-flanking",
+                *options,
             ],
+            cwd=workdir,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
         )
@@ -99,11 +153,12 @@ def runPredigMHCflurry(df_csv: pd.DataFrame, predigMHCflurry_path: str):
     except Exception as e:
         raise Exception(f"An error occurred while running the PredigMHCflurry: {e}")
 
+    output = os.path.join(workdir, output)
     df = pd.read_csv(output)
     df = df.rename(columns={"allele": "hla_allele", "peptide": "epitope"})
     df.to_csv(output, index=True)
 
-    os.remove(".input_MHCflurry.csv")
+    os.remove(os.path.join(workdir, ".input_MHCflurry.csv"))
 
     return df
 
@@ -119,8 +174,11 @@ def runPredigNetCleave(
     df_csv: typing.Optional[pd.DataFrame] = None,
     fasta: typing.Optional[str] = None,
     python_exec="python",
+    workdir: typing.Optional[str] = None,
 ):
 
+    workdir = workdir or currentWorkdir()
+
     if df_csv is None and fasta is None:
         raise ValueError("Either df_csv or fasta must be provided.")
 
@@ -138,10 +196,10 @@ def runPredigNetCleave(
             raise ValueError(f"Unsupported mode '{mode}' with CSV input.")
 
         net_cleave_input = ".input_NetCleave.csv"
-        df_csv.to_csv(net_cleave_input, index=False)
+        df_csv.to_csv(os.path.join(workdir, net_cleave_input), index=False)
 
     elif fasta is not None:
-        net_cleave_input = fasta
+        net_cleave_input = resolvePath(fasta)
 
     # Run the NetCleave
     # python_path_env = "/home/lavane/micromamba/envs/horus/bin/python"
@@ -152,16 +210,17 @@ def runPredigNetCleave(
     python_exec = python_exec.strip().split(" ")
     cmd = [
         *python_exec,
-        predigNetcleave_path,
+        resolvePath(predigNetcleave_path),
         "--predict",
         net_cleave_input,
         "--pred_input",
         str(mode),
     ]
     try:
-        proc = subprocess.Popen(
+        proc = TrackedPopen(
             cmd,
             # env=env,
+            cwd=workdir,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
         )
@@ -180,7 +239,7 @@ def runPredigNetCleave(
     else:
         raise ValueError(f"Unsupported mode '{mode}'.")
 
-    output = os.path.join("output", output)
+    output = os.path.join(workdir, "output", output)
     df = pd.read_csv(output)
 
     print("============== NetCleave report ==============")
@@ -201,14 +260,22 @@ def runPredigNetCleave(
     df = df.rename(columns={"prediction": "netcleave"})
     df.to_csv(output, index=True)
 
-    shutil.rmtree("output")
+    shutil.rmtree(os.path.join(workdir, "output"))
+    if df_csv is not None:
+        os.remove(os.path.join(workdir, net_cleave_input))
     return df
 
 
 def runPredigNOAH(
-    df_csv: pd.DataFrame, predigNOAH_path: str, model: str, python_exec: str = "python"
+    df_csv: pd.DataFrame,
+    predigNOAH_path: str,
+    model: str,
+    python_exec: str = "python",
+    workdir: typing.Optional[str] = None,
 ) -> pd.DataFrame:
 
+    workdir = workdir or currentWorkdir()
+
     # Check if 'peptide' and 'allele' columns exist
     if "peptide" not in df_csv.columns and "epitope" not in df_csv.columns:
         raise ValueError(
@@ -232,43 +299,163 @@ def runPredigNOAH(
 
     df_csv = df_csv[["peptide", "allele"]]
     df_csv = df_csv.rename(columns={"allele": "HLA"})
-    df_csv.to_csv(".input_noah.csv", index=False)
+    df_csv.to_csv(os.path.join(workdir, ".input_noah.csv"), index=False)
 
     # Run the NOAH
     python_exec_list = python_exec.strip().split(" ")
     cmd = [
         *python_exec_list,
-        predigNOAH_path,
+        resolvePath(predigNOAH_path),
         "-i",
         ".input_noah.csv",
         "-m",
-        model,
+        resolvePath(model),
         "-o",
         ".output_noah.csv",
     ]
     try:
-        with subprocess.Popen(cmd) as proc:
+        with TrackedPopen(cmd, cwd=workdir) as proc:
             proc.wait()
     except Exception as e:
         raise Exception(f"An error occurred while running the NOAH: {e}")
     print("Parsing NOAH output")
 
-    output = "output_noah_parsed.csv"
+    output = os.path.join(workdir, "output_noah_parsed.csv")
 
     df = pd.read_csv(
-        ".output_noah.csv",
+        os.path.join(workdir, ".output_noah.csv"),
         delimiter="\t",
         header=None,
     )
     df.columns = ["hla_allele", "epitope", "NOAH"]
     df.to_csv(output, index=True)
 
-    os.remove(".input_noah.csv")
-    os.remove(".output_noah.csv")
+    os.remove(os.path.join(workdir, ".input_noah.csv"))
+    os.remove(os.path.join(workdir, ".output_noah.csv"))
 
     return df
 
 
+def _pipeTool(
+    cmd: typing.List[str],
+    stdin_data: str,
+    on_line: typing.Callable[[str], None],
+    workdir: str = ".",
+) -> typing.Tuple[int, str]:
+    """
+    Run a tool feeding stdin_data on its standard input and calling on_line
+    for every line of its standard output as it is produced.
+    Returns the exit code and the standard error of the tool.
+    """
+
+    proc = TrackedPopen(
+        cmd,
+        cwd=workdir,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    stdin = typing.cast(typing.TextIO, proc.stdin)
+    stdout = typing.cast(typing.TextIO, proc.stdout)
+    stderr: typing.List[str] = []
+
+    # Written and drained from threads, so no pipe buffer fills up
+    def feed():
+        try:
+            stdin.write(stdin_data)
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+    def drain():
+        stderr.append(typing.cast(typing.TextIO, proc.stderr).read())
+
+    threads = [threading.Thread(target=feed), threading.Thread(target=drain)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for line in stdout:
+            on_line(line)
+    finally:
+        stdout.close()
+        for thread in threads:
+            thread.join()
+        proc.wait()
+
+    return proc.returncode, "".join(stderr)
+
+
+def _run_tapmap_size(
+    tapmap_path: str,
+    mat: str,
+    size: int,
+    peptides: typing.List[str],
+    alpha: typing.Union[float, None],
+    precursor_len: typing.Union[int, None],
+    workdir: str = ".",
+    tool_io: str = "files",
+) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Run tapmat_pred_fsa for the peptides of a single length and return the
+    (epitope, TAP) rows of its output. With tool_io="pipes" the fasta goes
+    through its standard input and the output is parsed as it streams,
+    with "files" they go through .input_tapmap_{size}.fasta and
+    .output_tapmap_{size}.txt in workdir.
+    """
+
+    print(f"Running tapmap for peptides of size {size}")
+    fasta = "".join(f">{i}\n{peptide}\n" for i, peptide in enumerate(peptides))
+
+    cmd = [resolvePath(tapmap_path)]
+    if mat:
+        cmd += ["-mat", resolvePath(mat)]
+    if alpha:
+        cmd += ["-a", str(alpha)]
+    cmd += ["-l", str(size)]
+    if precursor_len:
+        cmd += ["-pl", str(precursor_len)]
+
+    rows: typing.List[typing.Tuple[str, str]] = []
+
+    def parse(line: str):
+        if not line.startswith("#"):
+            parts = line.split()
+            # Ensure there are at least three parts in the line
+            if len(parts) >= 3:
+                rows.append((parts[1], parts[2]))
+
+    try:
+        if tool_io == "pipes":
+            _, stderr = _pipeTool(cmd + ["/dev/stdin"], fasta, parse, workdir)
+        else:
+            input_file = os.path.join(workdir, f".input_tapmap_{size}.fasta")
+            output_file = os.path.join(workdir, f".output_tapmap_{size}.txt")
+            with open(input_file, "w") as f:
+                f.write(fasta)
+            with open(output_file, "w") as outfile:
+                proc = TrackedPopen(
+                    cmd + [f".input_tapmap_{size}.fasta"],
+                    cwd=workdir,
+                    stdout=outfile,
+                    stderr=subprocess.PIPE,
+                )
+                stderr = proc.communicate()[1].decode()
+            with open(output_file, "r") as infile:
+                for line in infile:
+                    parse(line)
+            os.remove(input_file)
+            os.remove(output_file)
+        print("Error:", stderr)
+    except Exception as e:
+        raise Exception(
+            f"An error occurred while running the tapmap size={size}: {e}"
+        )
+
+    return rows
+
+
 def run_Predig_tapmap(
     df_csv: pd.DataFrame,
     tapmap_path: str,
@@ -276,8 +463,13 @@ def run_Predig_tapmap(
     peptide_len: typing.Optional[list[int]],
     alpha: typing.Union[float, None],
     precursor_len: typing.Union[int, None],
+    workers: int = 1,
+    workdir: typing.Optional[str] = None,
+    tool_io: str = "files",
 ) -> pd.DataFrame:
 
+    workdir = workdir or currentWorkdir()
+
     # Check if 'peptide' and 'allele' columns exist
     if "peptide" not in df_csv.columns and "epitope" not in df_csv.columns:
         raise ValueError(
@@ -303,58 +495,37 @@ def run_Predig_tapmap(
                 else:
                     dict_sizes[len(peptide)] = [peptide]
 
-    for size in dict_sizes:
-        with open(f".input_tapmap_{size}.fasta", "w") as f:
-            for i, peptide in enumerate(dict_sizes[size]):
-                f.write(f">{i}\n")
-                f.write(peptide + "\n")
-
-    for size in dict_sizes:
-        print(f"Running tapmap for peptides of size {size}")
-        command = tapmap_path
-        if mat:
-            command += f" -mat {mat} "
-        if alpha:
-            command += f"-a {alpha} "
-        command += f"-l {size} "
-        if precursor_len:
-            command += f"-pl {precursor_len} "
-        command += f".input_tapmap_{size}.fasta > .output_tapmap_{size}.txt"
-        try:
-            proc = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                shell=True,
-            )
-            stdout, stderr = proc.communicate()
-            print("Output:", stdout.decode())
-            print("Error:", stderr.decode())
-        except Exception as e:
-            raise Exception(
-                f"An error occurred while running the tapmap size={size}: {e}"
+    # Every length group is an independent tapmat_pred_fsa process, the
+    # threads run in a copy of the context so the processes keep their stage
+    workers = max(1, min(int(workers), len(dict_sizes)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run,
+                _run_tapmap_size,
+                tapmap_path,
+                mat,
+                size,
+                dict_sizes[size],
+                alpha,
+                precursor_len,
+                workdir,
+                tool_io,
             )
+            for size in dict_sizes
+        ]
+
+        print("Parsing tapmap output")
 
-    print("Parsing tapmap output")
-
-    epitope = []
-    tap = []
-    for size in dict_sizes:
-        with open(f".output_tapmap_{size}.txt", "r") as infile:
-            for line in infile:
-                if not line.startswith("#"):
-                    parts = line.split()
-                    if (
-                        len(parts) >= 3
-                    ):  # Ensure there are at least three parts in the line
-                        epitope.append(parts[1])
-                        tap.append(parts[2])
-
-    for size in dict_sizes:
-        os.remove(f".input_tapmap_{size}.fasta")
-        os.remove(f".output_tapmap_{size}.txt")
+        epitope = []
+        tap = []
+        for future in futures:
+            for row in future.result():
+                epitope.append(row[0])
+                tap.append(row[1])
 
     df = pd.DataFrame({"epitope": epitope, "TAP": tap})
-    df.to_csv("output_tapmap.csv", index=False)
+    if tool_io != "pipes":
+        df.to_csv(os.path.join(workdir, "output_tapmap.csv"), index=False)
 
     return df
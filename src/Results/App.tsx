@@ -23,8 +23,8 @@ import {
   useQuery,
 } from "@tanstack/react-query";
 import { IconDownload, IconInfoCircle } from "@tabler/icons-react";
-import { ColDef } from "ag-grid-community";
-import { useRef, useState } from "react";
+import { ColDef, IDatasource, IGetRowsParams } from "ag-grid-community";
+import { useMemo, useRef, useState } from "react";
 
 // Create a client
 const queryClient = new QueryClient();
@@ -109,27 +109,93 @@ function getURL(options?: { download?: boolean; fullSimulation?: boolean }) {
   return url.toString();
 }
 
-async function getDataFromHorus() {
-  try {
-    const response = await fetch(getURL());
+type ResultsPage = {
+  results: PredIGResult[];
+  columns: string[];
+  numeric: string[];
+  total: number;
+  filtered: number;
+  offset: number;
+};
 
-    if (!response.ok) {
-      const errorText = await response.text();
-      throw new Error(errorText || response.statusText);
-    }
+type PageQuery = {
+  offset: number;
+  limit: number;
+  sort?: string;
+  order?: "asc" | "desc";
+  filters?: string[];
+};
+
+// Rows requested at a time by the grid
+const PAGE_SIZE = 200;
+
+// ag-grid filter types and the matching operators of the results API
+const NUMBER_OPERATORS: Record<string, string> = {
+  equals: "==",
+  notEqual: "!=",
+  lessThan: "<",
+  lessThanOrEqual: "<=",
+  greaterThan: ">",
+  greaterThanOrEqual: ">=",
+};
+
+const TEXT_OPERATORS: Record<string, string> = {
+  contains: "~",
+  equals: "==",
+  notEqual: "!=",
+};
 
-    const data = await response.json();
+async function getResultsPage(query: PageQuery) {
+  const url = new URL(getURL());
+  url.searchParams.set("offset", String(query.offset));
+  url.searchParams.set("limit", String(query.limit));
+
+  if (query.sort) {
+    url.searchParams.set("sort", query.sort);
+    url.searchParams.set("order", query.order ?? "asc");
+  }
+
+  for (const filter of query.filters ?? []) {
+    url.searchParams.append("filter", filter);
+  }
+
+  const response = await fetch(url.toString());
+
+  if (!response.ok) {
+    const errorText = await response.text();
+    throw new Error(errorText || response.statusText);
+  }
 
-    if (!data.ok) {
-      throw new Error(data.msg || "Unknown error");
+  const data = await response.json();
+
+  if (!data.ok) {
+    throw new Error(data.msg || "Unknown error");
+  }
+
+  return data as ResultsPage;
+}
+
+// Translate the ag-grid filter model into the filter conditions of the API
+function toFilters(filterModel: Record<string, any>) {
+  const filters: string[] = [];
+
+  for (const [column, model] of Object.entries(filterModel)) {
+    if (model.filterType === "number" && model.type === "inRange") {
+      filters.push(`${column}>=${model.filter}`);
+      filters.push(`${column}<=${model.filterTo}`);
+      continue;
     }
 
-    return data as {
-      results: PredIGResult[];
-      columns: string[];
-    };
-  } catch (error) {    throw error; // Re-throw to be caught by react-query
+    const operators =
+      model.filterType === "number" ? NUMBER_OPERATORS : TEXT_OPERATORS;
+    const operator = operators[model.type];
+
+    if (operator && model.filter !== undefined && model.filter !== null) {
+      filters.push(`${column}${operator}${model.filter}`);
+    }
   }
+
+  return filters;
 }
 
 function Welcome() {
@@ -166,13 +232,34 @@ function downloadFile(fullSimulation: boolean) {
 function PredIGResults() {
   const [isDownloading, setIsDownloading] = useState(false);
 
+  // Only the columns and the row counts, the grid loads the rows it shows
   const { data, isLoading, isError, error } = useQuery({
     queryKey: ["results"],
-    queryFn: getDataFromHorus,
+    queryFn: () => getResultsPage({ offset: 0, limit: 0 }),
   });
 
   const gridRef = useRef<AgGridReact>(null);
 
+  // Every block of rows is sorted, filtered and paged by the server
+  const datasource = useMemo<IDatasource>(
+    () => ({
+      getRows: (params: IGetRowsParams) => {
+        const sort = params.sortModel[0];
+
+        getResultsPage({
+          offset: params.startRow,
+          limit: params.endRow - params.startRow,
+          sort: sort?.colId,
+          order: sort?.sort,
+          filters: toFilters(params.filterModel),
+        })
+          .then((page) => params.successCallback(page.results, page.filtered))
+          .catch(() => params.failCallback());
+      },
+    }),
+    [],
+  );
+
   if (isLoading) {
     return (
       <Stack align="center">
@@ -196,8 +283,17 @@ function PredIGResults() {
   }
 
   const colDef: ColDef[] = data.columns.map((col) => {
+    const numeric = data.numeric.includes(col);
+
     return {
-      filter: true,
+      filter: numeric ? "agNumberColumnFilter" : "agTextColumnFilter",
+      filterParams: {
+        filterOptions: numeric
+          ? [...Object.keys(NUMBER_OPERATORS), "inRange"]
+          : Object.keys(TEXT_OPERATORS),
+        // The API combines the filters of different columns only
+        maxNumConditions: 1,
+      },
       field: col,
       header: prettifyName(col),
       headerName: prettifyName(col),
@@ -236,10 +332,11 @@ function PredIGResults() {
           Download simulation
         </Button>
       </Group>
+      <Text ta="center">{data.total} results</Text>
       <div
         className="ag-theme-quartz" // applying the Data Grid theme
         style={{
-          minHeight: "10px",
+          height: "70vh",
           width: "100%",
           overflow: "hidden",
           padding: 20,
@@ -247,9 +344,11 @@ function PredIGResults() {
       >
         <AgGridReact
           ref={gridRef}
-          rowData={data.results}
+          rowModelType="infinite"
+          datasource={datasource}
+          cacheBlockSize={PAGE_SIZE}
+          maxBlocksInCache={10}
           columnDefs={colDef}
-          domLayout="autoHeight"
           defaultColDef={{
             flex: 1,
             minWidth: 200,
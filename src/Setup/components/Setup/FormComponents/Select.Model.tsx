@@ -1,4 +1,4 @@
-import { Button, Group, Input, Radio } from "@mantine/core";
+import { Button, Checkbox, Group, Input, Radio } from "@mantine/core";
 import { VariableSetter } from "../types";
 
 export const PREDIG_MODELS = ["PredIG-NeoA", "PredIG-NonCan", "PredIG-Path"];
@@ -22,6 +22,24 @@ export function SelectModel({ value, setValue }: VariableSetter<string>) {
   );
 }
 
+export function SelectModels({ value, setValue }: VariableSetter<string[]>) {
+  return (
+    <Input.Wrapper
+      label="Additional models"
+      description="Also score with these models, one column per model"
+      mt="md"
+    >
+      <Checkbox.Group value={value} onChange={setValue} mt={10}>
+        <Group>
+          {PREDIG_MODELS.map((model) => (
+            <Checkbox key={model} value={model} label={model} />
+          ))}
+        </Group>
+      </Checkbox.Group>
+    </Input.Wrapper>
+  );
+}
+
 export function CustomModel({ value, setValue }: VariableSetter<string>) {
   return (
     <Group mt="xs" align="end">
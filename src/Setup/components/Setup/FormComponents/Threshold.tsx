@@ -0,0 +1,28 @@
+import { Input, NumberInput } from "@mantine/core";
+import { VariableSetter } from "../types";
+
+export function Threshold({
+  value,
+  setValue,
+}: VariableSetter<number | undefined>) {
+  return (
+    <Input.Wrapper
+      label="Immunogenicity threshold"
+      description="Classify the results with a PredIG score at or above it, leave empty to skip"
+      mt="md"
+    >
+      <NumberInput
+        value={value ?? ""}
+        placeholder="0.5"
+        min={0}
+        max={1}
+        step={0.05}
+        decimalScale={3}
+        mt={10}
+        onChange={(threshold) =>
+          setValue(typeof threshold === "number" ? threshold : undefined)
+        }
+      />
+    </Input.Wrapper>
+  );
+}
@@ -1,12 +1,17 @@
 import { Button, Divider, Group, Stack, Stepper } from "@mantine/core";
 import { useEffect, useState } from "react";
 
-import { PREDIG_MODELS, SelectModel } from "./FormComponents/Select.Model";
+import {
+  PREDIG_MODELS,
+  SelectModel,
+  SelectModels,
+} from "./FormComponents/Select.Model";
 import { ConfigurationSavedModal } from "./FormComponents/Save.Variable";
 import { PredIGVariables, SimulationMode } from "./types";
 import { CSVInput } from "./FormComponents/CSV.Input";
 import { SelectSimulation } from "./FormComponents/Select.Simulation";
 import { Hallele } from "./FormComponents/Hallele";
+import { Threshold } from "./FormComponents/Threshold";
 
 const DEFAULT_SETUP: PredIGVariables = {
   simulation: SimulationMode.UNIPROT,
@@ -198,6 +203,20 @@ function StepViewer({
               setPredIGVariables({ ...predIGVariables, modelXG })
             }
           />
+          <SelectModels
+            label="Additional models"
+            value={predIGVariables.modelsXG ?? []}
+            setValue={(modelsXG) =>
+              setPredIGVariables({ ...predIGVariables, modelsXG })
+            }
+          />
+          <Threshold
+            label="Immunogenicity threshold"
+            value={predIGVariables.threshold}
+            setValue={(threshold) =>
+              setPredIGVariables({ ...predIGVariables, threshold })
+            }
+          />
           {predIGVariables.simulation === SimulationMode.FASTA && (
             <Hallele
               sampleData={SAMPLE_DATA["alleles"]}
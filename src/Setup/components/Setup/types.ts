@@ -19,6 +19,8 @@ export type PredIGVariables = {
   input_text: string;
   seed: number;
   modelXG: string;
+  modelsXG?: string[];
+  threshold?: number;
   HLA_alleles: string;
   peptide_len?: string[];
   mat: string;